@@ -2,6 +2,7 @@ from utils import *
 from .utils import *
 from typing import Optional
 from dataclasses import dataclass
+import re
 
 
 @dataclass
@@ -59,49 +60,119 @@ class AssemblyEqn:
         return Gate(self.L(), self.R(), self.M(), self.O(), self.C())
 
 
-# Converts a arithmetic expression containing numbers, variables and {+, -, *}
-# into a mapping of term to coefficient
+# Splits a line into tokens: the operators <==, ===, +, - and *, words
+# (variable names, numbers and keywords), and any other single character,
+# which the parser rejects
+TOKEN_PATTERN = re.compile(r"<==|===|[+*-]|[^\s+*<=-]+|\S")
+
+
+def tokenize(line: str) -> list[str]:
+    return TOKEN_PATTERN.findall(line)
+
+
+# A term is the sorted tuple of the ids of the variables it multiplies:
+# () for the constant term, (a,) for a, (a, b) for a*b
+Term = tuple[int, ...]
+
+
+# Product of two mappings of term to coefficient
+def multiply(L: dict[Term, int], R: dict[Term, int]) -> dict[Term, int]:
+    o: dict[Term, int] = {}
+    for t1, c1 in L.items():
+        for t2, c2 in R.items():
+            term = tuple(sorted(t1 + t2))
+            o[term] = o.get(term, 0) + c1 * c2
+    return o
+
+
+# Single pass precedence parser for arithmetic expressions over numbers,
+# variables and {+, -, *}, with the usual precedence and unary minus:
+#
+# expression := product (("+" | "-") product)*
+# product    := unary ("*" unary)*
+# unary      := "-" unary | number | variable
+#
+# Expressions are parsed into a mapping of term to coefficient, with the
+# variable names interned in `variables`
+class ExpressionParser:
+    """Expression parser"""
+
+    tokens: list[str]
+    pos: int
+    variables: VariableTable
+    # Ids of the variables used in the expression, in order of first use
+    used: list[int]
+    # The same ids, for membership checks
+    used_set: set[int]
+
+    def __init__(self, tokens: list[str], variables: VariableTable):
+        self.tokens = tokens
+        self.pos = 0
+        self.variables = variables
+        self.used = []
+        self.used_set = set()
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> dict[Term, int]:
+        o = self.expression()
+        if self.pos < len(self.tokens):
+            raise Exception("Unexpected token: {}".format(self.tokens[self.pos]))
+        return o
+
+    def expression(self) -> dict[Term, int]:
+        o = self.product()
+        while self.peek() in ("+", "-"):
+            sign = 1 if self.tokens[self.pos] == "+" else -1
+            self.pos += 1
+            for term, coeff in self.product().items():
+                o[term] = o.get(term, 0) + sign * coeff
+        return o
+
+    def product(self) -> dict[Term, int]:
+        o = self.unary()
+        while self.peek() == "*":
+            self.pos += 1
+            o = multiply(o, self.unary())
+        return o
+
+    def unary(self) -> dict[Term, int]:
+        token = self.peek()
+        if token is None:
+            raise Exception("Unexpected end of expression")
+        self.pos += 1
+        if token == "-":
+            return {term: -coeff for term, coeff in self.unary().items()}
+        elif token.isnumeric():
+            return {(): int(token)}
+        elif is_valid_variable_name(token):
+            var = self.variables.intern(token)
+            if var not in self.used_set:
+                self.used.append(var)
+                self.used_set.add(var)
+            return {(var,): 1}
+        else:
+            raise Exception("Expected a number or variable, found {}".format(token))
+
+
+# Converts an arithmetic expression containing numbers, variables and
+# {+, -, *} into a mapping of term to coefficient
 #
 # For example:
 # ['a', '+', 'b', '*', 'c', '*', '5'] becomes {'a': 1, 'b*c': 5}
 #
-# Note that this is a recursive algo, so the input can be a mix of tokens and
-# mapping expressions
-#
-def evaluate(exprs: list[str], first_is_negative=False) -> dict[Optional[str], int]:
-    # Splits by + and - first, then *, to follow order of operations
-    # The first_is_negative flag helps us correctly interpret expressions
-    # like 6000 - 700 - 80 + 9 (that's 5229)
-    if "+" in exprs:
-        L = evaluate(exprs[: exprs.index("+")], first_is_negative)
-        R = evaluate(exprs[exprs.index("+") + 1 :], False)
-        return {x: L.get(x, 0) + R.get(x, 0) for x in set(L.keys()).union(R.keys())}
-    elif "-" in exprs:
-        L = evaluate(exprs[: exprs.index("-")], first_is_negative)
-        R = evaluate(exprs[exprs.index("-") + 1 :], True)
-        return {x: L.get(x, 0) + R.get(x, 0) for x in set(L.keys()).union(R.keys())}
-    elif "*" in exprs:
-        L = evaluate(exprs[: exprs.index("*")], first_is_negative)
-        R = evaluate(exprs[exprs.index("*") + 1 :], first_is_negative)
-        o = {}
-        for k1 in L.keys():
-            for k2 in R.keys():
-                o[get_product_key(k1, k2)] = L[k1] * R[k2]
-        return o
-    elif len(exprs) > 1:
-        raise Exception("No ops, expected sub-expr to be a unit: {}".format(exprs[1]))
-    elif exprs[0][0] == "-":
-        return evaluate([exprs[0][1:]], not first_is_negative)
-    elif exprs[0].isnumeric():
-        return {"": int(exprs[0]) * (-1 if first_is_negative else 1)}
-    elif is_valid_variable_name(exprs[0]):
-        return {exprs[0]: -1 if first_is_negative else 1}
-    else:
-        raise Exception("ok wtf is {}".format(exprs[0]))
+def evaluate(
+    exprs: list[str], variables: Optional[VariableTable] = None
+) -> dict[Optional[str], int]:
+    variables = variables or VariableTable()
+    coeffs = ExpressionParser(exprs, variables).parse()
+    return {variables.key(term): coeff for term, coeff in coeffs.items()}
 
 
 # Converts an equation to a mapping of term to coefficient, and verifies that
-# the operations in the equation are valid.
+# the operations in the equation are valid. Variable names are interned in
+# `variables`, which is shared by all the equations of a program
 #
 # Also outputs a triple containing the L and R input variables and the output
 # variable
@@ -119,45 +190,55 @@ def evaluate(exprs: list[str], first_is_negative=False) -> dict[Optional[str], i
 # a <== b * * c                # Two times signs in a row
 # e <== a + b * c * d          # Multiplicative degree > 2
 #
-def eq_to_assembly(eq: str) -> AssemblyEqn:
-    tokens = eq.rstrip("\n").split(" ")
+def eq_to_assembly(eq: str, variables: Optional[VariableTable] = None) -> AssemblyEqn:
+    variables = variables or VariableTable()
+    tokens = tokenize(eq)
+    # Handle the "-x === a * b" case
+    negative_out = len(tokens) > 0 and tokens[0] == "-"
+    if negative_out:
+        tokens = tokens[1:]
+    if len(tokens) < 2:
+        raise Exception("Incomplete equation: {}".format(eq))
     if tokens[1] in ("<==", "==="):
         # First token is the output variable
         out = tokens[0]
-        # Convert the expression to coefficient map form
-        coeffs = evaluate(tokens[2:])
-        # Handle the "-x === a * b" case
-        if out[0] == "-":
-            out = out[1:]
-            coeffs["$output_coeff"] = -1
         # Check out variable name validity
         if not is_valid_variable_name(out):
             raise Exception("Invalid out variable name: {}".format(out))
-        # Gather list of variables used in the expression
-        variables = []
-        for t in tokens[2:]:
-            var = t.lstrip("-")
-            if is_valid_variable_name(var) and var not in variables:
-                variables.append(var)
-        # Construct the list of allowed coefficients
-        allowed_coeffs = variables + ["", "$output_coeff"]
-        if len(variables) == 0:
+        # Convert the expression to coefficient map form
+        parser = ExpressionParser(tokens[2:], variables)
+        coeffs = parser.parse()
+        # List of variables used in the expression, in order
+        ids = parser.used
+        # Construct the set of allowed terms
+        allowed_terms: set[Term] = {()} | {(var,) for var in ids}
+        if len(ids) == 0:
             pass
-        elif len(variables) == 1:
-            variables.append(variables[0])
-            allowed_coeffs.append(get_product_key(*variables))
-        elif len(variables) == 2:
-            allowed_coeffs.append(get_product_key(*variables))
+        elif len(ids) == 1:
+            ids.append(ids[0])
+            allowed_terms.add((ids[0], ids[0]))
+        elif len(ids) == 2:
+            allowed_terms.add(tuple(sorted(ids)))
         else:
-            raise Exception("Max 2 variables, found {}".format(variables))
-        # Check that only allowed coefficients are in the coefficient map
-        for key in coeffs.keys():
-            if key not in allowed_coeffs:
-                raise Exception("Disallowed multiplication: {}".format(key))
+            names = [variables.names[var] for var in ids]
+            raise Exception("Max 2 variables, found {}".format(names))
+        # Check that only allowed terms are in the coefficient map
+        for term in coeffs:
+            if term not in allowed_terms:
+                raise Exception(
+                    "Disallowed multiplication: {}".format(variables.key(term))
+                )
+        out_coeffs: dict[Optional[str], int] = {
+            variables.key(term): coeff for term, coeff in coeffs.items()
+        }
+        if negative_out:
+            out_coeffs["$output_coeff"] = -1
+        variables.intern(out)
         # Return output
-        wires = variables + [None] * (2 - len(variables)) + [out]
-        return AssemblyEqn(GateWires(wires[0], wires[1], wires[2]), coeffs)
-    elif tokens[1] == "public":
+        wires = [variables.names[var] for var in ids] + [None] * (2 - len(ids))
+        return AssemblyEqn(GateWires(wires[0], wires[1], out), out_coeffs)
+    elif tokens[1] == "public" and len(tokens) == 2 and not negative_out:
+        variables.intern(tokens[0])
         return AssemblyEqn(
             GateWires(tokens[0], None, None),
             {tokens[0]: -1, "$output_coeff": 0, "$public": True},
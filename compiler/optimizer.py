@@ -0,0 +1,171 @@
+from utils import *
+from .assembly import *
+from .utils import *
+from typing import Iterable, Optional
+from dataclasses import dataclass
+
+
+# A constraint as the optimizer sees it: out_coeff * out = sum of the terms,
+# with variables as ids. `eqn` is kept in sync with the terms
+@dataclass
+class Row:
+    """Optimizer row"""
+
+    out: Optional[int]
+    out_coeff: int
+    terms: dict[Term, int]
+    eqn: AssemblyEqn
+
+    @classmethod
+    def from_eqn(cls, eqn: AssemblyEqn, variables: VariableTable) -> "Row":
+        terms: dict[Term, int] = {}
+        for key, coeff in eqn.coeffs.items():
+            if key is None or not key.startswith("$"):
+                names = (key or "").split("*")
+                terms[tuple(sorted(variables.ids[x] for x in names if x))] = coeff
+        out = None if eqn.wires.O is None else variables.ids[eqn.wires.O]
+        return cls(out, eqn.coeffs.get("$output_coeff", 1), terms, eqn)
+
+    # Ids of the variables on the wires of the row
+    def wires(self, variables: VariableTable) -> set[int]:
+        return {variables.ids[x] for x in self.eqn.wires.as_list() if x is not None}
+
+    # The value of `out` as a linear expression of other variables, if it is
+    # one
+    def linear_definition(self) -> Optional[dict[Term, int]]:
+        if self.out is None or self.out_coeff not in (-1, 1):
+            return None
+        if any(len(term) > 1 or self.out in term for term in self.terms):
+            return None
+        return {term: coeff * self.out_coeff for term, coeff in self.terms.items()}
+
+    # The equation of the row with the given terms, or None if they do not
+    # fit in one gate: at most two input variables, and no product other than
+    # theirs
+    def rebuild(
+        self, terms: dict[Term, int], variables: VariableTable
+    ) -> Optional[AssemblyEqn]:
+        terms = {term: coeff for term, coeff in terms.items() if coeff != 0}
+        inputs: list[int] = []
+        for term in terms:
+            for var in term:
+                if var not in inputs:
+                    inputs.append(var)
+        if len(inputs) > 2:
+            return None
+        if len(inputs) == 1:
+            inputs.append(inputs[0])
+        allowed: set[Term] = {()} | {(var,) for var in inputs}
+        if len(inputs) == 2:
+            allowed.add(tuple(sorted(inputs)))
+        if any(term not in allowed for term in terms):
+            return None
+        wires = [variables.names[var] for var in inputs] + [None] * (2 - len(inputs))
+        coeffs: dict[Optional[str], int] = {
+            variables.key(term): coeff for term, coeff in terms.items()
+        }
+        if self.out_coeff != 1:
+            coeffs["$output_coeff"] = self.out_coeff
+        out = None if self.out is None else variables.names[self.out]
+        return AssemblyEqn(GateWires(wires[0], wires[1], out), coeffs)
+
+
+# The terms with every occurrence of `var` replaced by `definition`. The
+# coefficients are reduced, keeping small negative ones as they are
+def substitute(
+    terms: dict[Term, int], var: int, definition: dict[Term, int]
+) -> dict[Term, int]:
+    modulus = Scalar.field_modulus
+    o: dict[Term, int] = {}
+    for term, coeff in terms.items():
+        expanded: dict[Term, int] = {(): coeff}
+        for x in term:
+            expanded = multiply(expanded, definition if x == var else {(x,): 1})
+        for t, c in expanded.items():
+            o[t] = o.get(t, 0) + c
+    for t, c in o.items():
+        c %= modulus
+        o[t] = c - modulus if c > modulus // 2 else c
+    return o
+
+
+# Optimization pass over a program's constraints, which returns fewer rows
+# with the same public inputs and the same witness for every remaining
+# variable:
+#
+# - Constant folding and linear merging: a variable defined as a linear
+#   combination of other variables (or as a constant) is substituted into
+#   every later row that uses it, and its own row dropped, as long as each of
+#   those rows still fits in one gate. Rows that become constant or linear
+#   this way are substituted in turn
+# - Dead gate elimination: rows defining a variable that no other row uses
+#   are dropped
+#
+# Public variables and the variables in `keep` are never removed
+def optimize(
+    constraints: list[AssemblyEqn],
+    variables: VariableTable,
+    keep: Iterable[str] = (),
+) -> list[AssemblyEqn]:
+    rows = [Row.from_eqn(eqn, variables) for eqn in constraints]
+    kept = {variables.ids[name] for name in keep if name in variables.ids}
+    # Rows whose wires use each variable
+    uses: dict[int, set[int]] = {}
+    for i, row in enumerate(rows):
+        if row.eqn.coeffs.get("$public", False) is True:
+            assert row.eqn.wires.L is not None
+            kept.add(variables.ids[row.eqn.wires.L])
+        for var in row.wires(variables):
+            uses.setdefault(var, set()).add(i)
+    live = [True] * len(rows)
+
+    def drop(i: int):
+        live[i] = False
+        for var in rows[i].wires(variables):
+            uses[var].discard(i)
+
+    def merge(i: int) -> bool:
+        row = rows[i]
+        out = row.out
+        definition = row.linear_definition()
+        if definition is None or out is None or out in kept:
+            return False
+        users = uses[out] - {i}
+        # Only later rows that read the variable can take its definition
+        if any(j < i or rows[j].out == out for j in users):
+            return False
+        rebuilt = {}
+        for j in users:
+            terms = substitute(rows[j].terms, out, definition)
+            eqn = rows[j].rebuild(terms, variables)
+            if eqn is None:
+                return False
+            rebuilt[j] = (terms, eqn)
+        for j, (terms, eqn) in rebuilt.items():
+            for var in rows[j].wires(variables):
+                uses[var].discard(j)
+            rows[j].terms, rows[j].eqn = terms, eqn
+            for var in rows[j].wires(variables):
+                uses.setdefault(var, set()).add(j)
+        drop(i)
+        return True
+
+    def dead(i: int) -> bool:
+        out = rows[i].out
+        if out is None or out in kept or uses[out] != {i}:
+            return False
+        if rows[i].out_coeff not in (-1, 1):
+            return False
+        drop(i)
+        return True
+
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(rows)):
+            if live[i] and merge(i):
+                changed = True
+        for i in reversed(range(len(rows))):
+            if live[i] and dead(i):
+                changed = True
+    return [row.eqn for row, alive in zip(rows, live) if alive]
@@ -3,8 +3,13 @@
 from utils import *
 from .assembly import *
 from .utils import *
-from typing import Optional, Set
+from .witness import WitnessTape
+from .optimizer import optimize
+from typing import Iterable, Optional
+from dataclasses import dataclass, field
+from functools import cached_property
 from poly import Polynomial, Basis
+from domain import EvaluationDomain, COSET_OFFSET
 
 
 @dataclass
@@ -29,17 +34,138 @@ class CommonPreprocessedInput:
     # S_σ3(X) third permutation polynomial S_σ3(X)
     S3: Polynomial
 
+    # Everything above is the same for every proof of the program, so the
+    # forms the prover needs are computed once and cached: the coefficient
+    # form of each polynomial, and its Lagrange form over the coset extended
+    # domain (see COSET_OFFSET)
+    _coeffs: Optional[dict[str, Polynomial]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _coset_extended: Optional[dict[str, Polynomial]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    # Names of the fixed polynomials
+    POLYNOMIALS = ("QM", "QL", "QR", "QO", "QC", "S1", "S2", "S3")
+
+    # Coefficient forms, keyed by polynomial name
+    def coeffs(self) -> dict[str, Polynomial]:
+        if self._coeffs is None:
+            self._coeffs = {
+                name: getattr(self, name).ifft() for name in self.POLYNOMIALS
+            }
+        return self._coeffs
+
+    # Coset extended Lagrange forms over COSET_OFFSET, keyed by polynomial
+    # name
+    def coset_extended(self) -> dict[str, Polynomial]:
+        if self._coset_extended is None:
+            coeffs = self.coeffs()
+            extended = Polynomial.coeffs_to_coset_extended_lagrange_batch(
+                [coeffs[name] for name in self.POLYNOMIALS], COSET_OFFSET
+            )
+            self._coset_extended = dict(zip(self.POLYNOMIALS, extended))
+        return self._coset_extended
+
+
+# Smallest group order the prover supports: below it, the high part of the
+# quotient polynomial is zero, and its commitment is the point at infinity
+MIN_GROUP_ORDER = 4
+# Largest group order: the quotient is computed over the extended domain of
+# order 4n, whose roots of unity must exist in the scalar field (the largest
+# power of two dividing its multiplicative group is 2**28)
+MAX_GROUP_ORDER = 2**28 // 4
+
+# Work done by Prover for a group order n, as (size, count) pairs: FFTs and
+# MSMs per proof, and for the preprocessing (the coefficient and coset
+# extended forms of pk, and the verification key). Checked against the
+# prover by fft_count_test
+PROOF_FFTS = ((1, 10), (4, 11))
+PROOF_MSMS = ((1, 10),)
+PREPROCESSING_FFTS = ((1, 16), (4, 8))
+PREPROCESSING_MSMS = ((1, 8),)
+# Peak memory of the preprocessing and one proof, per row, as traced by
+# tracemalloc for group orders 256 and 1024 (about 200 ints per row)
+PROOF_BYTES_PER_ROW = 12 * 1024
+
+
+# Smallest power of two group order that fits `rows` rows
+def minimal_group_order(rows: int) -> int:
+    group_order = MIN_GROUP_ORDER
+    while group_order < rows:
+        group_order *= 2
+    if group_order > MAX_GROUP_ORDER:
+        raise Exception("Too many rows: {} (max {})".format(rows, MAX_GROUP_ORDER))
+    return group_order
+
+
+# Checks that the group order is usable for `rows` rows, or picks the
+# smallest one if it is None
+def check_group_order(rows: int, group_order: Optional[int]) -> int:
+    if group_order is None:
+        return minimal_group_order(rows)
+    if rows > group_order:
+        raise Exception("Group order too small")
+    if group_order & (group_order - 1) != 0:
+        raise Exception("Group order must be a power of two: {}".format(group_order))
+    if not MIN_GROUP_ORDER <= group_order <= MAX_GROUP_ORDER:
+        raise Exception(
+            "Group order must be between {} and {}: {}".format(
+                MIN_GROUP_ORDER, MAX_GROUP_ORDER, group_order
+            )
+        )
+    return group_order
+
+
+@dataclass
+class ProvingCost:
+    """Proving cost estimate"""
+
+    group_order: int
+    # Order of the coset extended domain of the quotient polynomial
+    extended_order: int
+    # Number of G1 powers of x the setup must have
+    setup_powers: int
+    # FFTs (forward and inverse) and MSMs, keyed by size
+    proof_ffts: dict[int, int]
+    proof_msms: dict[int, int]
+    preprocessing_ffts: dict[int, int]
+    preprocessing_msms: dict[int, int]
+    # Approximate peak memory of the preprocessing and one proof, in bytes
+    memory: int
+
+    @classmethod
+    def estimate(cls, group_order: int) -> "ProvingCost":
+        def sizes(work: tuple[tuple[int, int], ...]) -> dict[int, int]:
+            return {group_order * factor: count for factor, count in work}
+
+        return cls(
+            group_order=group_order,
+            extended_order=group_order * 4,
+            setup_powers=group_order,
+            proof_ffts=sizes(PROOF_FFTS),
+            proof_msms=sizes(PROOF_MSMS),
+            preprocessing_ffts=sizes(PREPROCESSING_FFTS),
+            preprocessing_msms=sizes(PREPROCESSING_MSMS),
+            memory=group_order * PROOF_BYTES_PER_ROW,
+        )
+
 
 class Program:
     constraints: list[AssemblyEqn]
     group_order: int
+    # Names and ids of every variable of the program
+    variables: VariableTable
 
-    def __init__(self, constraints: list[str], group_order: int):
-        if len(constraints) > group_order:
-            raise Exception("Group order too small")
-        assembly = [eq_to_assembly(constraint) for constraint in constraints]
+    # If no group order is given, picks the smallest one that fits the
+    # constraints
+    def __init__(self, constraints: list[str], group_order: Optional[int] = None):
+        self.group_order = check_group_order(len(constraints), group_order)
+        self.variables = VariableTable()
+        assembly = [
+            eq_to_assembly(constraint, self.variables) for constraint in constraints
+        ]
         self.constraints = assembly
-        self.group_order = group_order
 
     def common_preprocessed_input(self) -> CommonPreprocessedInput:
         L, R, M, O, C = self.make_gate_polynomials()
@@ -57,60 +183,95 @@ class Program:
         )
 
     @classmethod
-    def from_str(cls, constraints: str, group_order: int):
+    def from_str(cls, constraints: str, group_order: Optional[int] = None):
         lines = [line.strip() for line in constraints.split("\n")]
         return cls(lines, group_order)
 
+    # A program made of already compiled constraints
+    @classmethod
+    def from_assembly(
+        cls,
+        constraints: list[AssemblyEqn],
+        group_order: Optional[int],
+        variables: VariableTable,
+    ) -> "Program":
+        program = cls.__new__(cls)
+        program.group_order = check_group_order(len(constraints), group_order)
+        program.constraints = constraints
+        program.variables = variables
+        return program
+
+    # The program after the optimization pass of compiler.optimizer, which
+    # keeps the public variables and the ones in `keep`. If no group order
+    # is given, picks the smallest one that fits the optimized constraints.
+    # The rows saved are len(self.constraints) - len(optimized.constraints)
+    def optimized(
+        self, keep: Iterable[str] = (), group_order: Optional[int] = None
+    ) -> "Program":
+        constraints = optimize(self.constraints, self.variables, keep)
+        return Program.from_assembly(constraints, group_order, self.variables)
+
+    # What proving this program costs, before doing any of it
+    def cost_estimate(self) -> ProvingCost:
+        return ProvingCost.estimate(self.group_order)
+
     def coeffs(self) -> list[dict[Optional[str], int]]:
         return [constraint.coeffs for constraint in self.constraints]
 
     def wires(self) -> list[GateWires]:
         return [constraint.wires for constraint in self.constraints]
 
+    # Builds the permutation polynomials of the copy constraints. Every cell
+    # (column, row) is numbered 3 * row + column, so that walking the cells
+    # in order visits the uses of each variable sorted by (row, column); the
+    # unused rows are all uses of the None variable.
+    #
+    # Each variable's uses are rotated by one. For example, if some variable
+    # is used in positions (LEFT, 4), (LEFT, 7) and (OUTPUT, 2), then we
+    # store:
+    #
+    # at S[LEFT][7] the field element representing (LEFT, 4)
+    # at S[OUTPUT][2] the field element representing (LEFT, 7)
+    # at S[LEFT][4] the field element representing (OUTPUT, 2)
+    #
+    # where (column, row) is represented by ω**row * column
     def make_s_polynomials(self) -> dict[Column, Polynomial]:
-        # For each variable, extract the list of (column, row) positions
-        # where that variable is used
-        variable_uses: dict[Optional[str], Set[Cell]] = {None: set()}
+        n = self.group_order
+        columns = Column.variants()
+        # Integer ids of the variables, with None as 0
+        ids: dict[Optional[str], int] = {None: 0}
+        cell_ids = [0] * (3 * n)
         for row, constraint in enumerate(self.constraints):
-            for column, value in zip(Column.variants(), constraint.wires.as_list()):
-                if value not in variable_uses:
-                    variable_uses[value] = set()
-                variable_uses[value].add(Cell(column, row))
-
-        # Mark unused cells
-        for row in range(len(self.constraints), self.group_order):
-            for column in Column.variants():
-                variable_uses[None].add(Cell(column, row))
-
-        # For each list of positions, rotate by one.
-        #
-        # For example, if some variable is used in positions
-        # (LEFT, 4), (LEFT, 7) and (OUTPUT, 2), then we store:
-        #
-        # at S[LEFT][7] the field element representing (LEFT, 4)
-        # at S[OUTPUT][2] the field element representing (LEFT, 7)
-        # at S[LEFT][4] the field element representing (OUTPUT, 2)
-
-        S_values = {
-            Column.LEFT: [Scalar(0)] * self.group_order,
-            Column.RIGHT: [Scalar(0)] * self.group_order,
-            Column.OUTPUT: [Scalar(0)] * self.group_order,
-        }
+            for column, value in enumerate(constraint.wires.as_list()):
+                cell_ids[3 * row + column] = ids.setdefault(value, len(ids))
 
-        for _, uses in variable_uses.items():
-            sorted_uses = sorted(uses)
-            for i, cell in enumerate(sorted_uses):
-                next_i = (i + 1) % len(sorted_uses)
-                next_column = sorted_uses[next_i].column
-                next_row = sorted_uses[next_i].row
-                S_values[next_column][next_row] = cell.label(self.group_order)
-
-        S = {}
-        S[Column.LEFT] = Polynomial(S_values[Column.LEFT], Basis.LAGRANGE)
-        S[Column.RIGHT] = Polynomial(S_values[Column.RIGHT], Basis.LAGRANGE)
-        S[Column.OUTPUT] = Polynomial(S_values[Column.OUTPUT], Basis.LAGRANGE)
+        # In one pass: point each use at the previous use of its variable,
+        # and remember the first and last uses to close the cycles
+        first = [-1] * len(ids)
+        last = [-1] * len(ids)
+        sigma = [0] * (3 * n)
+        for cell, var in enumerate(cell_ids):
+            if first[var] < 0:
+                first[var] = cell
+            else:
+                sigma[cell] = last[var]
+            last[var] = cell
+        for start, end in zip(first, last):
+            if start >= 0:
+                sigma[start] = end
 
-        return S
+        roots = [x.n for x in EvaluationDomain.get(n).roots]
+        modulus = Scalar.field_modulus
+        labels = [
+            [roots[row] * column.value % modulus for row in range(n)]
+            for column in columns
+        ]
+        return {
+            column: Polynomial.from_ints(
+                [labels[s % 3][s // 3] for s in sigma[i::3]], Basis.LAGRANGE
+            )
+            for i, column in enumerate(columns)
+        }
 
     # Get the list of public variable assignments, in order
     def get_public_assignments(self) -> list[Optional[str]]:
@@ -154,6 +315,11 @@ class Program:
             Polynomial(C, Basis.LAGRANGE),
         )
 
+    # The program compiled for witness generation
+    @cached_property
+    def witness_tape(self) -> WitnessTape:
+        return WitnessTape.compile(self.constraints, self.variables)
+
     # Attempts to "run" the program to fill in any intermediate variable
     # assignments, starting from the given assignments. Eg. if
     # `starting_assignments` contains {'a': 3, 'b': 5}, and the first line
@@ -161,32 +327,11 @@ class Program:
     def fill_variable_assignments(
         self, starting_assignments: dict[Optional[str], int]
     ) -> dict[Optional[str], int]:
-        out = {k: Scalar(v) for k, v in starting_assignments.items()}
-        out[None] = Scalar(0)
-        for constraint in self.constraints:
-            wires = constraint.wires
-            coeffs = constraint.coeffs
-            in_L = wires.L
-            in_R = wires.R
-            output = wires.O
-            out_coeff = coeffs.get("$output_coeff", 1)
-            product_key = get_product_key(in_L, in_R)
-            if output is not None and out_coeff in (-1, 1):
-                new_value = (
-                    Scalar(
-                        coeffs.get("", 0)
-                        + out[in_L] * coeffs.get(in_L, 0)
-                        + out[in_R] * coeffs.get(in_R, 0) * (1 if in_R != in_L else 0)
-                        + out[in_L] * out[in_R] * coeffs.get(product_key, 0)
-                    )
-                    * out_coeff
-                )  # should be / but equivalent for (1, -1)
-                if output in out:
-                    if out[output] != new_value:
-                        raise Exception(
-                            "Failed assertion: {} = {}".format(out[output], new_value)
-                        )
-                else:
-                    out[output] = new_value
-                    # print('filled in:', output, out[output])
-        return {k: v.n for k, v in out.items()}
+        return self.witness_tape.fill(starting_assignments)
+
+    # Same as fill_variable_assignments, for many starting assignments at
+    # once. They must all assign the same variables
+    def fill_variable_assignments_batch(
+        self, starting_assignments: list[dict[Optional[str], int]]
+    ) -> list[dict[Optional[str], int]]:
+        return self.witness_tape.fill_batch(starting_assignments)
@@ -1,4 +1,5 @@
 from utils import *
+from domain import EvaluationDomain
 from enum import Enum
 from dataclasses import dataclass
 
@@ -44,7 +45,35 @@ class Cell:
     # (column, row) pair. Expects section = 1 for left, 2 right, 3 output
     def label(self, group_order: int) -> Scalar:
         assert self.row < group_order
-        return Scalar.roots_of_unity(group_order)[self.row] * self.column.value
+        return EvaluationDomain.get(group_order).roots[self.row] * self.column.value
+
+
+# Variable names interned as small integer ids, in order of first use, so
+# that the compiler can handle terms as tuples of ids rather than strings
+class VariableTable:
+    """Variable names and ids"""
+
+    names: list[str]
+    ids: dict[str, int]
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def intern(self, name: str) -> int:
+        var = self.ids.get(name)
+        if var is None:
+            var = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return var
+
+    # The key of a term (a tuple of ids) in the coeffs dictionary, as
+    # get_product_key would build it: "" for the constant term, else the
+    # sorted variable names joined by "*"
+    def key(self, term: tuple[int, ...]) -> str:
+        if len(term) == 1:
+            return self.names[term[0]]
+        return "*".join(sorted(self.names[var] for var in term))
 
 
 # Gets the key to use in the coeffs dictionary for the term for key1*key2,
@@ -0,0 +1,162 @@
+from utils import *
+from .assembly import *
+from .utils import *
+from typing import Optional
+from dataclasses import dataclass
+
+# Opcodes of the witness tape. Every instruction computes the value of its
+# output variable from its left and right variables L and R:
+# MUL:     out = k * L * R
+# LINEAR:  out = c + cL * L + cR * R
+# GENERAL: out = c + cL * L + cR * R + k * L * R
+OP_MUL = 0
+OP_LINEAR = 1
+OP_GENERAL = 2
+
+
+# A program compiled for witness generation: a flat tape of instructions
+# (opcode, out, left, right, c, cL, cR, k), with variables as integer slots
+# (slot 0 is the None variable, always 0) and the output coefficient folded
+# into reduced integer coefficients. An instruction whose output already
+# has a value checks it instead of assigning it
+@dataclass
+class WitnessTape:
+    """Witness generator"""
+
+    # Variable name of every slot
+    names: list[Optional[str]]
+    instructions: list[tuple[int, int, int, int, int, int, int, int]]
+
+    # One instruction per constraint that defines an output (the others,
+    # like public declarations, do not constrain the witness)
+    @classmethod
+    def compile(
+        cls, constraints: list[AssemblyEqn], variables: VariableTable
+    ) -> "WitnessTape":
+        modulus = Scalar.field_modulus
+        names: list[Optional[str]] = [None] + variables.names
+
+        def slot(name: Optional[str]) -> int:
+            return 0 if name is None else variables.ids[name] + 1
+
+        instructions = []
+        for constraint in constraints:
+            wires = constraint.wires
+            coeffs = constraint.coeffs
+            out_coeff = coeffs.get("$output_coeff", 1)
+            if wires.O is None or out_coeff not in (-1, 1):
+                continue
+            # out_coeff is its own inverse
+            c, cL, cR, k = [
+                x * out_coeff % modulus
+                for x in (
+                    coeffs.get("", 0),
+                    coeffs.get(wires.L, 0),
+                    coeffs.get(wires.R, 0) if wires.R != wires.L else 0,
+                    coeffs.get(get_product_key(wires.L, wires.R), 0),
+                )
+            ]
+            left, right = slot(wires.L), slot(wires.R)
+            # The None variable is 0, so products with it vanish
+            if left == 0 or right == 0:
+                k = 0
+            if k == 0:
+                op = OP_LINEAR
+            elif c == cL == cR == 0:
+                op = OP_MUL
+            else:
+                op = OP_GENERAL
+            instructions.append((op, slot(wires.O), left, right, c, cL, cR, k))
+        return cls(names, instructions)
+
+    # Slots holding the given assignments, with None for unknown variables
+    def load(self, assignments: list[dict[Optional[str], int]]) -> list:
+        keys = assignments[0].keys()
+        if any(a.keys() != keys for a in assignments):
+            raise Exception("Assignments of a batch must assign the same variables")
+        modulus = Scalar.field_modulus
+        slots: list = [None] * len(self.names)
+        for i, name in enumerate(self.names):
+            if name in keys and name is not None:
+                slots[i] = [a[name] % modulus for a in assignments]
+        slots[0] = [0] * len(assignments)
+        return slots
+
+    # Runs the tape starting from the given assignments, and returns the
+    # full assignments, like Program.fill_variable_assignments
+    def fill(
+        self, starting_assignments: dict[Optional[str], int]
+    ) -> dict[Optional[str], int]:
+        modulus = Scalar.field_modulus
+        slots = [x and x[0] for x in self.load([starting_assignments])]
+        for i, (op, out, left, right, c, cL, cR, k) in enumerate(self.instructions):
+            x = slots[left]
+            y = slots[right]
+            if x is None or y is None:
+                self.unassigned(i, slots)
+            if op == OP_MUL:
+                value = k * x * y % modulus
+            elif op == OP_LINEAR:
+                value = (c + cL * x + cR * y) % modulus
+            else:
+                value = (c + cL * x + cR * y + k * x * y) % modulus
+            current = slots[out]
+            if current is None:
+                slots[out] = value
+            elif current != value:
+                raise Exception("Failed assertion: {} = {}".format(current, value))
+        return self.store(
+            [starting_assignments], [None if x is None else [x] for x in slots]
+        )[0]
+
+    # Runs the tape on a batch of starting assignments at once, each
+    # instruction going over the whole batch. Every assignment of the batch
+    # must assign the same variables
+    def fill_batch(
+        self, starting_assignments: list[dict[Optional[str], int]]
+    ) -> list[dict[Optional[str], int]]:
+        if len(starting_assignments) == 0:
+            return []
+        modulus = Scalar.field_modulus
+        slots = self.load(starting_assignments)
+        for i, (op, out, left, right, c, cL, cR, k) in enumerate(self.instructions):
+            xs = slots[left]
+            ys = slots[right]
+            if xs is None or ys is None:
+                self.unassigned(i, slots)
+            if op == OP_MUL:
+                values = [k * x * y % modulus for x, y in zip(xs, ys)]
+            elif op == OP_LINEAR:
+                values = [(c + cL * x + cR * y) % modulus for x, y in zip(xs, ys)]
+            else:
+                values = [
+                    (c + cL * x + cR * y + k * x * y) % modulus for x, y in zip(xs, ys)
+                ]
+            current = slots[out]
+            if current is None:
+                slots[out] = values
+            elif current != values:
+                for x, y in zip(current, values):
+                    if x != y:
+                        raise Exception("Failed assertion: {} = {}".format(x, y))
+        return self.store(starting_assignments, slots)
+
+    def unassigned(self, i: int, slots: list):
+        _, _, left, right, *_ = self.instructions[i]
+        name = self.names[left if slots[left] is None else right]
+        raise Exception("Variable {} is used before it is assigned".format(name))
+
+    # The full assignments: the starting ones, then every variable with a
+    # value
+    def store(
+        self, starting_assignments: list[dict[Optional[str], int]], slots: list
+    ) -> list[dict[Optional[str], int]]:
+        modulus = Scalar.field_modulus
+        o = []
+        for j, assignments in enumerate(starting_assignments):
+            out = {k: v % modulus for k, v in assignments.items()}
+            for name, values in zip(self.names, slots):
+                if values is not None:
+                    out[name] = values[j]
+            o.append(out)
+        return o
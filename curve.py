@@ -1,6 +1,9 @@
 from py_ecc.fields.field_elements import FQ as Field
 import py_ecc.bn128 as b
-from typing import NewType
+import py_ecc.optimized_bn128 as ob
+from typing import NewType, Optional, Union
+from dataclasses import dataclass
+import sys
 
 primitive_root = 5
 G1Point = NewType("G1Point", tuple[b.FQ, b.FQ])
@@ -23,27 +26,73 @@ class Scalar(Field):
             o.append(o[-1] * o[1])
         return o
 
+    # Inverts a list of Scalars with a single modular inversion (see
+    # `batch_inverse`)
+    @classmethod
+    def batch_inverse(cls, values: list["Scalar"]) -> list["Scalar"]:
+        return [cls(x) for x in batch_inverse([x.n for x in values], cls.field_modulus)]
+
 
 Base = NewType("Base", b.FQ)
 
 
+# Inverts a list of ints modulo `modulus` with a single modular inversion
+# and 3 multiplications per element (Montgomery's trick): invert the product
+# of all the values, then peel the values off one by one, from the last one
+# to the first. Like Scalar division, zeros are "inverted" to zero
+def batch_inverse(values: list[int], modulus: int = b.curve_order) -> list[int]:
+    prefix = [1] * (len(values) + 1)
+    acc = 1
+    for i, x in enumerate(values):
+        if x % modulus != 0:
+            acc = acc * x % modulus
+        prefix[i + 1] = acc
+    # inv = 1 / (values[0] * ... * values[i]) at step i
+    inv = pow(acc, -1, modulus)
+    o = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        x = values[i] % modulus
+        if x != 0:
+            o[i] = inv * prefix[i] % modulus
+            inv = inv * x % modulus
+    return o
+
+
 def ec_mul(pt, coeff):
     if hasattr(coeff, "n"):
         coeff = coeff.n
-    return b.multiply(pt, coeff % b.curve_order)
+    coeff %= b.curve_order
+    if pt is not b.Z1 and not isinstance(pt[0], b.FQ):
+        # G2 points keep using py_ecc's affine arithmetic
+        return b.multiply(pt, coeff)
+    if pt is b.Z1 or coeff == 0:
+        return b.Z1
+    # G1: double-and-add in Jacobian coordinates, adding the affine input point
+    o = JACOBIAN_ZERO
+    x, y = pt[0].n, pt[1].n
+    for bit in bin(coeff)[2:]:
+        o = jacobian_double(o)
+        if bit == "1":
+            o = jacobian_add_mixed(o, x, y)
+    return from_jacobian(o)
 
 
-# Elliptic curve linear combination. A truly optimized implementation
-# would replace this with a fast lin-comb algo, see https://ethresear.ch/t/7238
+# Elliptic curve linear combination, computed with Pippenger's bucket method
+# (see `pippenger` below). The older subset-sum approach from
+# https://ethresear.ch/t/7238 is kept as `lincomb` for comparison.
+#
+# All the additions happen in Jacobian coordinates over plain ints (buckets
+# take the affine input points with a mixed addition), so there is a single
+# field inversion, when converting the result back to an affine G1Point
 def ec_lincomb(pairs):
-    return lincomb(
-        [pt for (pt, _) in pairs],  # [G, xG, x2G, ...]
-        [
-            int(n) % b.curve_order for (_, n) in pairs
-        ],  # [a1, a2, a3, ...](mod curve_order)
-        b.add,  # https://github.com/ethereum/py_ecc/blob/master/py_ecc/bn128/bn128_curve.py#L83
-        b.Z1,  # Point at infinity over FQ, Z1 = None - https://github.com/ethereum/py_ecc/blob/master/py_ecc/bn128/bn128_curve.py#L48C1-L49C10
-    )
+    points = []
+    factors = []
+    for pt, n in pairs:
+        factor = int(n) % b.curve_order  # [a1, a2, a3, ...](mod curve_order)
+        if pt is not b.Z1 and factor != 0:
+            points.append((pt[0].n, pt[1].n))  # [G, xG, x2G, ...]
+            factors.append(factor)
+    return msm(points, factors)
     # Equivalent to:
     # o = b.Z1
     # for pt, coeff in pairs:
@@ -51,6 +100,401 @@ def ec_lincomb(pairs):
     # return o
 
 
+# Pippenger over affine points given as (x, y) ints, with factors already
+# reduced mod curve_order
+def msm(points, factors) -> Optional[G1Point]:
+    return from_jacobian(
+        pippenger(
+            points,
+            factors,
+            jacobian_add,
+            JACOBIAN_ZERO,
+            doubler=jacobian_double,
+            mixed_adder=lambda o, pt: jacobian_add_mixed(o, pt[0], pt[1]),
+        )
+    )
+
+
+################################################################
+# Jacobian coordinates
+################################################################
+
+# A G1 point in Jacobian coordinates is a tuple of ints (X, Y, Z) standing
+# for the affine point (X / Z**2, Y / Z**3), with Z = 0 for the point at
+# infinity. Unlike py_ecc's affine `b.add`, additions and doublings here need
+# no field inversion. Formulas are the usual ones for curves y^2 = x^3 + b,
+# see https://hyperelliptic.org/EFD/g1p/auto-shortw-jacobian-0.html
+
+JACOBIAN_ZERO = (1, 1, 0)
+
+
+def to_jacobian(pt: G1Point):
+    if pt is b.Z1:
+        return JACOBIAN_ZERO
+    return (pt[0].n, pt[1].n, 1)
+
+
+def from_jacobian(pt) -> Optional[G1Point]:
+    X, Y, Z = pt
+    if Z == 0:
+        return b.Z1
+    p = b.field_modulus
+    z_inv = pow(Z, -1, p)
+    z_inv2 = z_inv * z_inv % p
+    return G1Point((b.FQ(X * z_inv2 % p), b.FQ(Y * z_inv2 * z_inv % p)))
+
+
+def jacobian_double(pt):
+    X, Y, Z = pt
+    if Z == 0:
+        return pt
+    p = b.field_modulus
+    YY = Y * Y % p
+    S = 4 * X * YY % p
+    M = 3 * X * X % p
+    X3 = (M * M - 2 * S) % p
+    Y3 = (M * (S - X3) - 8 * YY * YY) % p
+    Z3 = 2 * Y * Z % p
+    return (X3, Y3, Z3)
+
+
+def jacobian_add(pt1, pt2):
+    X1, Y1, Z1 = pt1
+    X2, Y2, Z2 = pt2
+    if Z1 == 0:
+        return pt2
+    if Z2 == 0:
+        return pt1
+    p = b.field_modulus
+    Z1Z1 = Z1 * Z1 % p
+    Z2Z2 = Z2 * Z2 % p
+    U1 = X1 * Z2Z2 % p
+    U2 = X2 * Z1Z1 % p
+    S1 = Y1 * Z2 * Z2Z2 % p
+    S2 = Y2 * Z1 * Z1Z1 % p
+    H = (U2 - U1) % p
+    R = (S2 - S1) % p
+    if H == 0:
+        return jacobian_double(pt1) if R == 0 else JACOBIAN_ZERO
+    HH = H * H % p
+    HHH = H * HH % p
+    V = U1 * HH % p
+    X3 = (R * R - HHH - 2 * V) % p
+    Y3 = (R * (V - X3) - S1 * HHH) % p
+    Z3 = Z1 * Z2 * H % p
+    return (X3, Y3, Z3)
+
+
+# Mixed addition: adds the affine point (x, y) (given as ints) to a point in
+# Jacobian coordinates; cheaper than `jacobian_add` since Z2 = 1
+def jacobian_add_mixed(pt, x, y):
+    X1, Y1, Z1 = pt
+    if Z1 == 0:
+        return (x, y, 1)
+    p = b.field_modulus
+    Z1Z1 = Z1 * Z1 % p
+    H = (x * Z1Z1 - X1) % p
+    R = (y * Z1 * Z1Z1 - Y1) % p
+    if H == 0:
+        return jacobian_double(pt) if R == 0 else JACOBIAN_ZERO
+    HH = H * H % p
+    HHH = H * HH % p
+    V = X1 * HH % p
+    X3 = (R * R - HHH - 2 * V) % p
+    Y3 = (R * (V - X3) - Y1 * HHH) % p
+    Z3 = Z1 * H % p
+    return (X3, Y3, Z3)
+
+
+# Converts a list of points in Jacobian coordinates to affine (x, y) ints
+# with a single field inversion (see `batch_inverse`). Points at infinity are
+# not allowed
+def batch_to_affine(points):
+    p = b.field_modulus
+    o = []
+    for (X, Y, _), z_inv in zip(points, batch_inverse([Z for _, _, Z in points], p)):
+        z_inv2 = z_inv * z_inv % p
+        o.append((X * z_inv2 % p, Y * z_inv2 * z_inv % p))
+    return o
+
+
+################################################################
+# Pairings
+################################################################
+
+# Pairings use py_ecc's optimized_bn128, which works on projective points and
+# is about 10x faster than bn128's affine pairing
+
+
+# Converts an affine G1 or G2 point to optimized_bn128's projective form
+def to_optimized(pt):
+    if pt is None:
+        return None
+    x, y = pt
+    if isinstance(x, b.FQ):
+        return (ob.FQ(x.n), ob.FQ(y.n), ob.FQ.one())
+    return (
+        ob.FQ2([int(c) for c in x.coeffs]),
+        ob.FQ2([int(c) for c in y.coeffs]),
+        ob.FQ2.one(),
+    )
+
+
+# The line of the Miller loop through the projective points P1 and P2 of
+# the twisted curve, as in py_ecc's optimized `linefunc`, but not yet
+# evaluated: at an affine G1 point (x, y), its value is
+# (A * x + B * y + C) / D. Returns (A, B, C, D)
+def line_coefficients(P1, P2):
+    x1, y1, z1 = P1
+    x2, y2, z2 = P2
+    m_numerator = y2 * z1 - y1 * z2
+    m_denominator = x2 * z1 - x1 * z2
+    if m_denominator == x1.zero():
+        if m_numerator != x1.zero():
+            # Vertical line
+            return z1, x1.zero(), -x1, z1
+        # Tangent line
+        m_numerator = 3 * x1 * x1
+        m_denominator = 2 * y1 * z1
+    return (
+        m_numerator * z1,
+        -m_denominator * z1,
+        m_denominator * y1 - m_numerator * x1,
+        m_denominator * z1,
+    )
+
+
+# The Miller loop of a fixed G2 point Q, with everything that does not
+# depend on the G1 point precomputed: the coefficients of every line, and
+# the product of all the line denominators (which only depend on Q). Build
+# it once for points that are paired many times, like a verification key's
+# [x]₂ and the generator of G2
+@dataclass
+class G2Lines:
+    # (square, A, B, C) for each line of the loop, in order: square tells
+    # whether the accumulator is squared before multiplying by the line
+    lines: list[tuple[bool, ob.FQ12, ob.FQ12, ob.FQ12]]
+    # What the Miller loop's numerator is divided by at the end
+    denominator: ob.FQ12
+
+    @classmethod
+    def build(cls, q: tuple[b.FQ2, b.FQ2]) -> "G2Lines":
+        Q = ob.twist(to_optimized(q))
+        R = Q
+        lines = []
+        denominator = ob.FQ12.one()
+        # Same steps as py_ecc's optimized `miller_loop`
+        for v in ob.optimized_pairing.pseudo_binary_encoding[63::-1]:
+            A, B, C, D = line_coefficients(R, R)
+            lines.append((True, A, B, C))
+            denominator = denominator * denominator * D
+            R = ob.double(R)
+            if v != 0:
+                addend = Q if v == 1 else ob.neg(Q)
+                A, B, C, D = line_coefficients(R, addend)
+                lines.append((False, A, B, C))
+                denominator = denominator * D
+                R = ob.add(R, addend)
+        field_modulus = ob.field_modulus
+        Q1 = (Q[0] ** field_modulus, Q[1] ** field_modulus, Q[2] ** field_modulus)
+        nQ2 = (
+            Q1[0] ** field_modulus,
+            -Q1[1] ** field_modulus,
+            Q1[2] ** field_modulus,
+        )
+        for addend in (Q1, nQ2):
+            A, B, C, D = line_coefficients(R, addend)
+            lines.append((False, A, B, C))
+            denominator = denominator * D
+            R = ob.add(R, addend)
+        return cls(lines, denominator)
+
+
+# Matrices of the Frobenius maps f -> f ** (p ** k) of FQ12, which are
+# linear over FQ: row i is the coefficients of (w ** i) ** (p ** k)
+FROBENIUS_MATRICES: dict[int, list[list[int]]] = {}
+
+
+def frobenius(f: ob.FQ12, k: int) -> ob.FQ12:
+    if k not in FROBENIUS_MATRICES:
+        w = ob.FQ12([0, 1] + [0] * 10) ** (ob.field_modulus**k)
+        rows = [ob.FQ12.one()]
+        while len(rows) < 12:
+            rows.append(rows[-1] * w)
+        FROBENIUS_MATRICES[k] = [[int(c) for c in row.coeffs] for row in rows]
+    matrix = FROBENIUS_MATRICES[k]
+    o = [0] * 12
+    for c, row in zip(map(int, f.coeffs), matrix):
+        if c:
+            for j in range(12):
+                o[j] += c * row[j]
+    return ob.FQ12([x % ob.field_modulus for x in o])
+
+
+# f ** ((p ** 12 - 1) / r), the same as py_ecc's `final_exponentiate`. The
+# exponent is split as (p ** 6 - 1) * (p ** 2 + 1) * ((p ** 4 - p ** 2 + 1) / r):
+# the first two factors only take Frobenius maps, so only the last one, about
+# 3.7x shorter than the whole exponent, is done by square-and-multiply
+def final_exponentiate(f: ob.FQ12) -> ob.FQ12:
+    f = frobenius(f, 6) / f
+    f = frobenius(f, 2) * f
+    return f ** ((ob.field_modulus**4 - ob.field_modulus**2 + 1) // b.curve_order)
+
+
+# Whether `pt` is an affine point of the curve with coordinates in `field`
+# (b.FQ for G1, b.FQ2 for G2), and not the point at infinity. G1 has
+# cofactor 1, so this is enough for a G1 point to be in the group
+def is_affine_point(pt, field=b.FQ) -> bool:
+    if not isinstance(pt, tuple) or len(pt) != 2:
+        return False
+    x, y = pt
+    if not isinstance(x, field) or not isinstance(y, field):
+        return False
+    if field is b.FQ:
+        return b.is_on_curve((x, y), b.b)
+    return b.is_on_curve((x, y), b.b2)
+
+
+# Checks that e(P_1, Q_1) * e(P_2, Q_2) * ... = 1 for the given (P_i, Q_i)
+# pairs of G1 and G2 points (None being the point at infinity). Q_i can also
+# be given as its G2Lines. All the Miller loops run together, sharing the
+# squarings of one accumulator, and there is a single final exponentiation
+# for the whole product. Returns False if any point is malformed or off the
+# curve
+def pairing_product_check(
+    pairs: list[
+        tuple[
+            Optional[tuple[b.FQ, b.FQ]], Union[Optional[tuple[b.FQ2, b.FQ2]], G2Lines]
+        ]
+    ]
+) -> bool:
+    evaluations: list[tuple[int, int, G2Lines]] = []
+    for p, q in pairs:
+        if p is None or q is None:
+            continue
+        if not is_affine_point(p):
+            return False
+        if isinstance(q, G2Lines):
+            lines = q
+        elif is_affine_point(q, b.FQ2):
+            lines = G2Lines.build(q)
+        else:
+            return False
+        evaluations.append((p[0].n, p[1].n, lines))
+    if len(evaluations) == 0:
+        return True
+
+    f = ob.FQ12.one()
+    for i, (square, _, _, _) in enumerate(evaluations[0][2].lines):
+        if square:
+            f = f * f
+        for x, y, q in evaluations:
+            _, A, B, C = q.lines[i]
+            f = f * (A * x + B * y + C)
+    denominator = ob.FQ12.one()
+    for _, _, q in evaluations:
+        denominator = denominator * q.denominator
+    return final_exponentiate(f / denominator) == ob.FQ12.one()
+
+
+################################################################
+# Fixed-base precomputation
+################################################################
+
+# Scalars are below the curve order, so they have at most this many bits
+SCALAR_BITS = b.curve_order.bit_length()
+
+
+# Precomputed multiples for linear combinations over a fixed list of G1
+# bases (eg. the powers of x in the trusted setup).
+#
+# For every base P_i and every window j, the table stores
+# 2**(window * j) * P_i in affine form. To compute sum(f_i * P_i), each
+# factor is cut into window-bit digits d_ij, and the stored multiple
+# 2**(window * j) * P_i is dropped into bucket d_ij. Bucket k then holds
+# everything that has to be taken k times, so one `sum_buckets` pass gives
+# the result: n * ceil(254 / window) + 2 * 2**window additions and no
+# doublings, at the cost of storing n * ceil(254 / window) points
+@dataclass
+class FixedBaseTable:
+    window: int
+    # multiples[i][j] = 2**(window * j) * bases[i], as affine (x, y) ints
+    multiples: list[list[tuple[int, int]]]
+
+    @classmethod
+    def build(cls, bases: list[G1Point], window: int):
+        windows = -(-SCALAR_BITS // window)
+        multiples: list[list[tuple[int, int]]] = [[] for _ in bases]
+        current = [to_jacobian(pt) for pt in bases]
+        for j in range(windows):
+            for row, pt in zip(multiples, batch_to_affine(current)):
+                row.append(pt)
+            if j < windows - 1:
+                for _ in range(window):
+                    current = [jacobian_double(pt) for pt in current]
+        return cls(window, multiples)
+
+    # Picks the window minimizing the cost of a linear combination over `n`
+    # bases, among those whose table fits in `max_bytes` (if given)
+    @classmethod
+    def window_size(cls, n: int, max_bytes=None) -> int:
+        candidates = [
+            c
+            for c in range(1, 21)
+            if max_bytes is None or cls.estimate_size(n, c) <= max_bytes
+        ]
+        if len(candidates) == 0:
+            raise Exception(
+                "No table for {} bases fits in {} bytes".format(n, max_bytes)
+            )
+        return min(candidates, key=lambda c: n * -(-SCALAR_BITS // c) + 2 ** (c + 1))
+
+    # Approximate memory taken by a table over `n` bases: each stored point
+    # is a tuple of two ints plus its 8-byte slot in the row list
+    @staticmethod
+    def estimate_size(n: int, window: int) -> int:
+        sample = (b.field_modulus - 1, b.field_modulus - 1)
+        point_size = sys.getsizeof(sample) + 2 * sys.getsizeof(sample[0]) + 8
+        return n * -(-SCALAR_BITS // window) * point_size
+
+    def bases(self) -> list[tuple[int, int]]:
+        return [row[0] for row in self.multiples]
+
+    def num_points(self) -> int:
+        return sum(len(row) for row in self.multiples)
+
+    def size_in_bytes(self) -> int:
+        return FixedBaseTable.estimate_size(len(self.multiples), self.window)
+
+    # Linear combination of bases[start:start + len(factors)] with factors
+    def lincomb(self, factors, start: int = 0) -> Optional[G1Point]:
+        assert start + len(factors) <= len(self.multiples)
+        window = self.window
+        n = len(factors)
+        rows = self.multiples[start : start + n]
+        # For short linear combinations the 2 * 2**window additions of the
+        # bucket pass dominate, and plain Pippenger is cheaper
+        c = pippenger_window_size(n, SCALAR_BITS)
+        pippenger_cost = -(-SCALAR_BITS // c) * (n + 2 ** (c + 1)) + SCALAR_BITS
+        if n * -(-SCALAR_BITS // window) + 2 ** (window + 1) > pippenger_cost:
+            return msm(
+                [row[0] for row in rows], [int(f) % b.curve_order for f in factors]
+            )
+        mask = (1 << window) - 1
+        buckets = [JACOBIAN_ZERO] * (mask + 1)
+        for row, factor in zip(rows, factors):
+            factor = int(factor) % b.curve_order
+            j = 0
+            while factor:
+                digit = factor & mask
+                if digit:
+                    x, y = row[j]
+                    buckets[digit] = jacobian_add_mixed(buckets[digit], x, y)
+                factor >>= window
+                j += 1
+        return from_jacobian(sum_buckets(buckets, jacobian_add, JACOBIAN_ZERO))
+
+
 ################################################################
 # multicombs
 ################################################################
@@ -113,6 +557,68 @@ def lincomb(numbers, factors, adder=lambda x, y: x + y, zero=0):
     return o
 
 
+# Picks the Pippenger window size (in bits) that minimizes the estimated
+# number of group operations for `n` numbers with `bitlen`-bit factors: each
+# of the ceil(bitlen / c) windows costs n bucket additions plus 2 * 2**c
+# additions to combine the buckets
+def pippenger_window_size(n, bitlen=256):
+    return min(range(1, 17), key=lambda c: -(-bitlen // c) * (n + 2 ** (c + 1)))
+
+
+# Computes `numbers[0] * factors[0] + numbers[1] * factors[1] + ...` with
+# Pippenger's bucket method. The factors are cut into `window`-bit digits.
+# For each window (from the top down), every number is added into the bucket
+# of its digit, and the buckets are then combined with a running sum so that
+# bucket k ends up counted k times. Consecutive windows are separated by
+# `window` doublings.
+#
+# `doubler` and `mixed_adder` (used to add a number into a bucket) default to
+# `adder`, but can be given cheaper specialised versions
+def pippenger(
+    numbers,
+    factors,
+    adder=lambda x, y: x + y,
+    zero=0,
+    window=None,
+    doubler=None,
+    mixed_adder=None,
+):
+    maxbitlen = max((f.bit_length() for f in factors), default=0)
+    if maxbitlen == 0:
+        return zero
+    if window is None:
+        window = pippenger_window_size(len(numbers), maxbitlen)
+    if doubler is None:
+        doubler = lambda x: adder(x, x)
+    if mixed_adder is None:
+        mixed_adder = adder
+    mask = (1 << window) - 1
+    o = zero
+    for shift in range(((maxbitlen - 1) // window) * window, -1, -window):
+        if o is not zero:
+            for _ in range(window):
+                o = doubler(o)
+        buckets = [zero] * (mask + 1)
+        for number, factor in zip(numbers, factors):
+            digit = (factor >> shift) & mask
+            if digit:
+                buckets[digit] = mixed_adder(buckets[digit], number)
+        o = adder(o, sum_buckets(buckets, adder, zero))
+    return o
+
+
+# Computes 1 * buckets[1] + 2 * buckets[2] + ... with 2 * len(buckets)
+# additions: running = buckets[-1] + ... + buckets[k], and the total adds up
+# every value of running, so bucket k is included exactly k times
+def sum_buckets(buckets, adder=lambda x, y: x + y, zero=0):
+    running = zero
+    total = zero
+    for k in range(len(buckets) - 1, 0, -1):
+        running = adder(running, buckets[k])
+        total = adder(total, running)
+    return total
+
+
 # Tests go here
 def make_mock_adder():
     counter = [0]
@@ -151,5 +657,85 @@ def test_lincomb(numcount, bitlength=256):
     )
 
 
+def test_pippenger(numcount, bitlength=256):
+    numbers = [random.randrange(10**20) for _ in range(numcount)]
+    factors = [random.randrange(2**bitlength) for _ in range(numcount)]
+    adder, counter = make_mock_adder()
+    o = lincomb(numbers, factors, adder=adder)
+    assert o == sum([n * f for n, f in zip(numbers, factors)])
+    lincomb_ops = counter[0]
+    adder, counter = make_mock_adder()
+    o = pippenger(numbers, factors, adder=adder)
+    assert o == sum([n * f for n, f in zip(numbers, factors)])
+    print("Window size: %d" % pippenger_window_size(numcount, bitlength))
+    print("Subset-sum lincomb operation count: %d" % lincomb_ops)
+    print("Pippenger operation count: %d" % counter[0])
+    print("Optimization factor: %.2f" % (lincomb_ops / counter[0]))
+
+
+# Times lincomb and pippenger on real G1 points, [1]G, [2]G, ..., [n]G
+def time_ec_lincomb(numcount):
+    import time
+
+    points = [b.G1]
+    while len(points) < numcount:
+        points.append(b.add(points[-1], b.G1))
+    factors = [random.randrange(b.curve_order) for _ in range(numcount)]
+    t0 = time.time()
+    o1 = lincomb(points, factors, b.add, b.Z1)
+    t1 = time.time()
+    o2 = pippenger(points, factors, b.add, b.Z1)
+    t2 = time.time()
+    o3 = ec_lincomb(list(zip(points, factors)))
+    t3 = time.time()
+    assert o1 == o2 == o3
+    print("Subset-sum lincomb time: %.3fs" % (t1 - t0))
+    print("Pippenger (affine) time: %.3fs" % (t2 - t1))
+    print("Pippenger (Jacobian) time: %.3fs" % (t3 - t2))
+
+
+def test_jacobian():
+    pt = b.multiply(b.G1, random.randrange(b.curve_order))
+    for k in (0, 1, 2, 3, random.randrange(b.curve_order), b.curve_order - 1):
+        assert ec_mul(pt, k) == b.multiply(pt, k)
+    assert ec_mul(b.G2, 5) == b.multiply(b.G2, 5)
+    assert from_jacobian(jacobian_add(to_jacobian(pt), to_jacobian(b.neg(pt)))) is b.Z1
+    assert from_jacobian(jacobian_add(to_jacobian(pt), to_jacobian(pt))) == b.double(pt)
+    assert from_jacobian(jacobian_add_mixed(JACOBIAN_ZERO, *to_jacobian(pt)[:2])) == pt
+
+
+def test_pairing_product_check():
+    assert pairing_product_check([(b.G1, b.G2), (b.neg(b.G1), b.G2)])
+    assert pairing_product_check(
+        [(b.multiply(b.G1, 6), b.G2), (b.neg(b.G1), b.multiply(b.G2, 6))]
+    )
+    assert not pairing_product_check([(b.G1, b.G2), (b.G1, b.G2)])
+    # Prepared G2 points
+    P, Q = b.multiply(b.G1, 11), b.multiply(b.G2, 7)
+    lines = G2Lines.build(Q)
+    assert pairing_product_check([(P, lines), (b.neg(b.multiply(P, 7)), b.G2)])
+    assert not pairing_product_check([(P, lines), (b.neg(P), b.G2)])
+    # Malformed points
+    assert not pairing_product_check([((b.G1[0], b.G1[0]), b.G2)])
+    assert not pairing_product_check([((1, 2), b.G2)])
+    assert not pairing_product_check([(b.G1, (b.G2[0], b.G2[0]))])
+    f = ob.FQ12([random.randrange(ob.field_modulus) for _ in range(12)])
+    assert final_exponentiate(f) == ob.final_exponentiate(f)
+
+
+def test_batch_inverse(numcount):
+    values = [random.randrange(b.curve_order) for _ in range(numcount)] + [0]
+    inverses = batch_inverse(values)
+    assert inverses[-1] == 0
+    for x, x_inv in zip(values[:-1], inverses[:-1]):
+        assert x * x_inv % b.curve_order == 1
+
+
 if __name__ == "__main__":
-    test_lincomb(int(sys.argv[1]) if len(sys.argv) >= 2 else 80)
+    numcount = int(sys.argv[1]) if len(sys.argv) >= 2 else 80
+    test_lincomb(numcount)
+    test_pippenger(numcount)
+    test_jacobian()
+    test_batch_inverse(numcount)
+    test_pairing_product_check()
+    time_ec_lincomb(numcount)
@@ -0,0 +1,128 @@
+from curve import Scalar
+from functools import cached_property
+import sys
+import time
+
+# How many coset power tables to keep per domain. The prover only uses
+# COSET_OFFSET, but other offsets can be passed to the polynomial methods
+COSET_POWERS_CACHE_SIZE = 4
+
+# Offset of the coset over which the prover computes the quotient polynomial.
+# The quotient does not depend on the coset, so it is fixed: 5 generates the
+# multiplicative group of the field, so 5 * µ**i is never in the evaluation
+# domain, and the forms of the fixed polynomials over the coset can be
+# computed once per circuit
+COSET_OFFSET = Scalar(5)
+
+
+# The roots of unity of a given group order, plus the tables derived from
+# them. Get instances through `EvaluationDomain.get`, so that every table is
+# computed at most once per process. The lists handed out are shared: treat
+# them as read-only
+class EvaluationDomain:
+    """Evaluation domain"""
+
+    group_order: int
+    # ω, the first root of unity of order group_order
+    omega: Scalar
+
+    _domains: dict[int, "EvaluationDomain"] = {}
+
+    def __init__(self, group_order: int):
+        assert group_order > 0 and group_order & (group_order - 1) == 0
+        self.group_order = group_order
+        self.omega = Scalar.root_of_unity(group_order)
+        self._coset_powers: dict[int, list[Scalar]] = {}
+
+    @classmethod
+    def get(cls, group_order: int) -> "EvaluationDomain":
+        if group_order not in cls._domains:
+            cls._domains[group_order] = cls(group_order)
+        return cls._domains[group_order]
+
+    # [1, ω, ω**2, ..., ω**(n-1)]
+    @cached_property
+    def roots(self) -> list[Scalar]:
+        o = [Scalar(1)]
+        while len(o) < self.group_order:
+            o.append(o[-1] * self.omega)
+        return o
+
+    # [1, ω**-1, ω**-2, ..., ω**-(n-1)]
+    @cached_property
+    def inverse_roots(self) -> list[Scalar]:
+        return self.roots[:1] + self.roots[1:][::-1]
+
+    # n**-1
+    @cached_property
+    def n_inv(self) -> Scalar:
+        return Scalar(1) / self.group_order
+
+    # Twiddle factors for the NTTs in poly, as ints: the first n/2 roots and
+    # the first n/2 inverse roots
+    @cached_property
+    def twiddles(self) -> tuple[list[int], list[int]]:
+        half = max(self.group_order // 2, 1)
+        return (
+            [x.n for x in self.roots[:half]],
+            [x.n for x in self.inverse_roots[:half]],
+        )
+
+    # The domain of order 4n, over which the quotient polynomial is computed
+    @property
+    def extended(self) -> "EvaluationDomain":
+        return EvaluationDomain.get(self.group_order * 4)
+
+    # [1, offset, offset**2, ..., offset**(n-1)]
+    def coset_powers(self, offset: Scalar) -> list[Scalar]:
+        offset = Scalar(offset)
+        if offset.n not in self._coset_powers:
+            if len(self._coset_powers) >= COSET_POWERS_CACHE_SIZE:
+                del self._coset_powers[next(iter(self._coset_powers))]
+            o = [Scalar(1)]
+            while len(o) < self.group_order:
+                o.append(o[-1] * offset)
+            self._coset_powers[offset.n] = o
+        return self._coset_powers[offset.n]
+
+    # Evaluations of the vanishing polynomial Z_H(X) = X^n - 1 over the coset
+    # offset * {1, µ, µ**2, ..., µ**(extension * n - 1)}, where
+    # µ**extension = ω, and their inverses. Since µ**n is a root of unity of
+    # order `extension`, Z_H(offset * µ**i) = offset**n * µ**(n * i) - 1 only
+    # takes `extension` distinct values, repeating with period `extension`.
+    # Returns (evaluations, inverses)
+    def vanishing_on_coset(
+        self, offset: Scalar, extension: int = 4
+    ) -> tuple[list[Scalar], list[Scalar]]:
+        offset_n = Scalar(offset) ** self.group_order
+        mu_n = Scalar.root_of_unity(extension)
+        distinct = [offset_n * mu_n**j - 1 for j in range(extension)]
+        assert all(x != 0 for x in distinct), "Coset intersects the domain"
+        distinct_inv = Scalar.batch_inverse(distinct)
+        return (
+            distinct * self.group_order,
+            distinct_inv * self.group_order,
+        )
+
+
+def time_vanishing_on_coset(group_order: int):
+    domain = EvaluationDomain.get(group_order)
+    offset = Scalar(5)
+    a = time.time()
+    evals, inverses = domain.vanishing_on_coset(offset)
+    b = time.time()
+    points = [offset * x for x in domain.extended.roots]
+    expected = [x**group_order - 1 for x in points]
+    c = time.time()
+    assert evals == expected
+    assert all(x * y == 1 for x, y in zip(evals, inverses))
+    print(
+        "Z_H on the 4n coset, n = {}: closed form {:.6f}s, pointwise {:.4f}s".format(
+            group_order, b - a, c - b
+        )
+    )
+
+
+if __name__ == "__main__":
+    for group_order in [int(x) for x in sys.argv[1:]] or [1024, 2048]:
+        time_vanishing_on_coset(group_order)
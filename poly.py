@@ -1,5 +1,7 @@
-from curve import Scalar
+from curve import Scalar, batch_inverse
+from domain import EvaluationDomain
 from enum import Enum
+from typing import Any, Optional
 
 
 class Basis(Enum):
@@ -7,101 +9,155 @@ class Basis(Enum):
     MONOMIAL = 2
 
 
+# Evaluations or coefficients are stored as a flat list of ints reduced
+# modulo the field modulus, so that the arithmetic below runs as bulk
+# integer operations instead of allocating a Scalar per element and per
+# operation. `values` gives the list-of-Scalar view of the same data
 class Polynomial:
-    values: list[Scalar]
     basis: Basis
+    _ints: list[int]
+    # None until `values` is first read, for polynomials built from ints
+    _values: Optional[list[Scalar]]
 
     def __init__(self, values: list[Scalar], basis: Basis):
-        assert all(isinstance(x, Scalar) for x in values)
         assert isinstance(basis, Basis)
-        self.values = values
+        self._ints = [x.n for x in values]
+        self._values = values
         self.basis = basis
 
+    # Builds a polynomial directly from ints that are already reduced
+    # modulo the field modulus, without going through Scalars
+    @classmethod
+    def from_ints(cls, ints: list[int], basis: Basis) -> "Polynomial":
+        assert isinstance(basis, Basis)
+        o = cls.__new__(cls)
+        o._ints = ints
+        o._values = None
+        o.basis = basis
+        return o
+
+    # The values as ints. Shared with this polynomial: treat as read-only
+    @property
+    def ints(self) -> list[int]:
+        return self._ints
+
+    # The values as Scalars, built on first access. Treat as read-only
+    @property
+    def values(self) -> list[Scalar]:
+        if self._values is None:
+            self._values = [Scalar(x) for x in self._ints]
+        return self._values
+
     def __eq__(self, other):
-        return (self.basis == other.basis) and (self.values == other.values)
+        return (self.basis == other.basis) and (self._ints == other._ints)
 
     def __add__(self, other):
+        modulus = Scalar.field_modulus
+        if isinstance(other, LazyPolynomial):
+            return self.lazy() + other
         if isinstance(other, Polynomial):
-            assert len(self.values) == len(other.values)
+            assert len(self._ints) == len(other._ints)
             assert self.basis == other.basis
 
-            return Polynomial(
-                [x + y for x, y in zip(self.values, other.values)],
+            return Polynomial.from_ints(
+                [(x + y) % modulus for x, y in zip(self._ints, other._ints)],
                 self.basis,
             )
         else:
             assert isinstance(other, Scalar)
             if self.basis == Basis.LAGRANGE:
-                return Polynomial(
-                    [x + other for x in self.values],
+                return Polynomial.from_ints(
+                    [(x + other.n) % modulus for x in self._ints],
                     self.basis,
                 )
             else:
-                return Polynomial(
-                    [self.values[0] + other] + self.values[1:], self.basis
+                return Polynomial.from_ints(
+                    [(self._ints[0] + other.n) % modulus] + self._ints[1:],
+                    self.basis,
                 )
 
     def __sub__(self, other):
+        modulus = Scalar.field_modulus
+        if isinstance(other, LazyPolynomial):
+            return self.lazy() - other
         if isinstance(other, Polynomial):
-            assert len(self.values) == len(other.values)
+            assert len(self._ints) == len(other._ints)
             assert self.basis == other.basis
 
-            return Polynomial(
-                [x - y for x, y in zip(self.values, other.values)],
+            return Polynomial.from_ints(
+                [(x - y) % modulus for x, y in zip(self._ints, other._ints)],
                 self.basis,
             )
         else:
             assert isinstance(other, Scalar)
             if self.basis == Basis.LAGRANGE:
-                return Polynomial(
-                    [x - other for x in self.values],
+                return Polynomial.from_ints(
+                    [(x - other.n) % modulus for x in self._ints],
                     self.basis,
                 )
             else:
-                return Polynomial(
-                    [self.values[0] - other] + self.values[1:], self.basis
+                return Polynomial.from_ints(
+                    [(self._ints[0] - other.n) % modulus] + self._ints[1:],
+                    self.basis,
                 )
 
     def __mul__(self, other):
+        modulus = Scalar.field_modulus
+        if isinstance(other, LazyPolynomial):
+            return self.lazy() * other
         if isinstance(other, Polynomial):
             assert self.basis == Basis.LAGRANGE
             assert self.basis == other.basis
-            assert len(self.values) == len(other.values)
+            assert len(self._ints) == len(other._ints)
 
-            return Polynomial(
-                [x * y for x, y in zip(self.values, other.values)],
+            return Polynomial.from_ints(
+                [x * y % modulus for x, y in zip(self._ints, other._ints)],
                 self.basis,
             )
         else:
             assert isinstance(other, Scalar)
-            return Polynomial(
-                [x * other for x in self.values],
+            return Polynomial.from_ints(
+                [x * other.n % modulus for x in self._ints],
                 self.basis,
             )
 
     def __truediv__(self, other):
+        modulus = Scalar.field_modulus
+        if isinstance(other, LazyPolynomial):
+            return self.lazy() / other
         if isinstance(other, Polynomial):
             assert self.basis == Basis.LAGRANGE
             assert self.basis == other.basis
-            assert len(self.values) == len(other.values)
+            assert len(self._ints) == len(other._ints)
 
-            return Polynomial(
-                [x / y for x, y in zip(self.values, other.values)],
+            # One modular inversion for the whole vector
+            return Polynomial.from_ints(
+                [
+                    x * y % modulus
+                    for x, y in zip(self._ints, batch_inverse(other._ints, modulus))
+                ],
                 self.basis,
             )
         else:
             assert isinstance(other, Scalar)
-            return Polynomial(
-                [x / other for x in self.values],
+            other_inv = (1 / other).n
+            return Polynomial.from_ints(
+                [x * other_inv % modulus for x in self._ints],
                 self.basis,
             )
 
+    # Opt-in lazy mode: returns a LazyPolynomial wrapping this polynomial,
+    # whose operators build an expression graph instead of computing
+    # intermediate polynomials (see LazyPolynomial)
+    def lazy(self) -> "LazyPolynomial":
+        return LazyPolynomial.leaf(self)
+
     def shift(self, shift: int):
         assert self.basis == Basis.LAGRANGE
-        assert shift < len(self.values)
+        assert shift < len(self._ints)
 
-        return Polynomial(
-            self.values[shift:] + self.values[:shift],
+        return Polynomial.from_ints(
+            self._ints[shift:] + self._ints[:shift],
             self.basis,
         )
 
@@ -111,35 +167,15 @@ class Polynomial:
         # Fast Fourier transform, used to convert between polynomial coefficients
         # and a list of evaluations at the roots of unity
         # See https://vitalik.ca/general/2019/05/12/fft.html
-        def _fft(vals, modulus, roots_of_unity):
-            if len(vals) == 1:
-                return vals
-            L = _fft(vals[::2], modulus, roots_of_unity[::2])
-            R = _fft(vals[1::2], modulus, roots_of_unity[::2])
-            o = [0] * len(vals)
-            for i, (x, y) in enumerate(zip(L, R)):
-                y_times_root = y * roots_of_unity[i]
-                o[i] = (x + y_times_root) % modulus
-                o[i + len(L)] = (x - y_times_root) % modulus
-            return o
-
-        roots = [x.n for x in Scalar.roots_of_unity(len(self.values))]
-        o, nvals = Scalar.field_modulus, [x.n for x in self.values]
+        nvals = list(self._ints)
         if inv:
             assert self.basis == Basis.LAGRANGE
             # Inverse FFT
-            invlen = Scalar(1) / len(self.values)
-            reversed_roots = [roots[0]] + roots[1:][::-1]
-            return Polynomial(
-                [Scalar(x) * invlen for x in _fft(nvals, o, reversed_roots)],
-                Basis.MONOMIAL,
-            )
+            return Polynomial.from_ints(intt(nvals), Basis.MONOMIAL)
         else:
             assert self.basis == Basis.MONOMIAL
             # Regular FFT
-            return Polynomial(
-                [Scalar(x) for x in _fft(nvals, o, roots)], Basis.LAGRANGE
-            )
+            return Polynomial.from_ints(ntt(nvals), Basis.LAGRANGE)
 
     def ifft(self):
         return self.fft(True)
@@ -151,42 +187,278 @@ class Polynomial:
     # avoid the 0/0 problem when computing a division (as long as the offset is
     # chosen randomly)
     def to_coset_extended_lagrange(self, offset):
-        assert self.basis == Basis.LAGRANGE
-        group_order = len(self.values)
-        x_powers = self.ifft().values
-        x_powers = [(offset**i * x) for i, x in enumerate(x_powers)] + [Scalar(0)] * (
-            group_order * 3
+        return Polynomial.to_coset_extended_lagrange_batch([self], offset)[0]
+
+    # Same as to_coset_extended_lagrange, for many polynomials over the same
+    # group order at once. They all share one table of offset powers and
+    # one set of twiddles
+    @staticmethod
+    def to_coset_extended_lagrange_batch(
+        polys: list["Polynomial"], offset
+    ) -> list["Polynomial"]:
+        for poly in polys:
+            assert poly.basis == Basis.LAGRANGE
+        return Polynomial.coeffs_to_coset_extended_lagrange_batch(
+            [poly.ifft() for poly in polys], offset
         )
-        return Polynomial(x_powers, Basis.MONOMIAL).fft()
+
+    # Same as to_coset_extended_lagrange_batch, for polynomials already in
+    # coefficient form (so that the inverse FFT can be skipped)
+    @staticmethod
+    def coeffs_to_coset_extended_lagrange_batch(
+        polys: list["Polynomial"], offset
+    ) -> list["Polynomial"]:
+        modulus = Scalar.field_modulus
+        group_order = len(polys[0].ints)
+        offset_powers = [
+            x.n for x in EvaluationDomain.get(group_order).coset_powers(offset)
+        ]
+        o = []
+        for poly in polys:
+            assert poly.basis == Basis.MONOMIAL
+            assert len(poly.ints) == group_order
+            x_powers = [p * x % modulus for p, x in zip(offset_powers, poly.ints)]
+            x_powers += [0] * (group_order * 3)
+            o.append(Polynomial.from_ints(ntt(x_powers), Basis.LAGRANGE))
+        return o
 
     # Convert from offset form into coefficients
     # Note that we can't make a full inverse function of to_coset_extended_lagrange
     # because the output of this might be a deg >= n polynomial, which cannot
     # be expressed via evaluations at n roots of unity
     def coset_extended_lagrange_to_coeffs(self, offset):
-        assert self.basis == Basis.LAGRANGE
+        return Polynomial.coset_extended_lagrange_to_coeffs_batch([self], offset)[0]
 
-        shifted_coeffs = self.ifft().values
-        inv_offset = 1 / offset
-        return Polynomial(
-            [v * inv_offset**i for (i, v) in enumerate(shifted_coeffs)],
-            Basis.MONOMIAL,
-        )
+    # Same as coset_extended_lagrange_to_coeffs, for many polynomials at once
+    @staticmethod
+    def coset_extended_lagrange_to_coeffs_batch(
+        polys: list["Polynomial"], offset
+    ) -> list["Polynomial"]:
+        modulus = Scalar.field_modulus
+        inv_offset_powers = [
+            x.n
+            for x in EvaluationDomain.get(len(polys[0].ints)).coset_powers(
+                1 / Scalar(offset)
+            )
+        ]
+        o = []
+        for poly in polys:
+            assert poly.basis == Basis.LAGRANGE
+            assert len(poly.ints) == len(inv_offset_powers)
+            shifted_coeffs = intt(list(poly.ints))
+            o.append(
+                Polynomial.from_ints(
+                    [
+                        v * p % modulus
+                        for v, p in zip(shifted_coeffs, inv_offset_powers)
+                    ],
+                    Basis.MONOMIAL,
+                )
+            )
+        return o
 
     # Given a polynomial expressed as a list of evaluations at roots of unity,
     # evaluate it at x directly, without using an FFT to convert to coeffs first
     def barycentric_eval(self, x: Scalar):
         assert self.basis == Basis.LAGRANGE
 
-        order = len(self.values)
-        roots_of_unity = Scalar.roots_of_unity(order)
-        return (
-            (Scalar(x) ** order - 1)
-            / order
-            * sum(
-                [
-                    value * root / (x - root)
-                    for value, root in zip(self.values, roots_of_unity)
-                ]
+        modulus = Scalar.field_modulus
+        x = Scalar(x)
+        order = len(self._ints)
+        roots_of_unity = [root.n for root in EvaluationDomain.get(order).roots]
+        inverses = batch_inverse([x.n - root for root in roots_of_unity], modulus)
+        total = 0
+        for value, root, inv in zip(self._ints, roots_of_unity, inverses):
+            total += value * root % modulus * inv
+        return (x**order - 1) / order * Scalar(total % modulus)
+
+
+# An expression over Lagrange basis polynomials of the same length, built by
+# the operators of LazyPolynomial (and of Polynomial, when one operand is
+# lazy). Nothing is computed until `evaluate`, which runs the whole
+# expression in a single fused pass over the evaluation points, so no
+# intermediate polynomial is ever materialized. Nodes are identified by
+# their structure, so a subexpression that appears several times (such as
+# the same polynomial used in many terms) is computed once per point.
+# Divisions by a polynomial expression evaluate the divisor first and batch
+# invert it
+class LazyPolynomial:
+    # ("leaf", index into leaves), ("const", value as an int) or
+    # (operator, left key, right key)
+    key: tuple
+    # The polynomials used by the expression, as lists of ints
+    leaves: dict[int, list[int]]
+
+    def __init__(self, key: tuple, leaves: dict[int, list[int]]):
+        self.key = key
+        self.leaves = leaves
+
+    @classmethod
+    def leaf(cls, poly: Polynomial) -> "LazyPolynomial":
+        assert poly.basis == Basis.LAGRANGE
+        return cls(("leaf", id(poly.ints)), {id(poly.ints): poly.ints})
+
+    def _combine(self, op: str, other) -> "LazyPolynomial":
+        if isinstance(other, Polynomial):
+            other = other.lazy()
+        if isinstance(other, LazyPolynomial):
+            return LazyPolynomial(
+                (op, self.key, other.key), {**self.leaves, **other.leaves}
             )
+        return LazyPolynomial((op, self.key, ("const", Scalar(other).n)), self.leaves)
+
+    def __add__(self, other):
+        return self._combine("+", other)
+
+    def __sub__(self, other):
+        return self._combine("-", other)
+
+    def __mul__(self, other):
+        return self._combine("*", other)
+
+    def __truediv__(self, other):
+        if isinstance(other, (Polynomial, LazyPolynomial)):
+            if isinstance(other, LazyPolynomial):
+                other = other.evaluate()
+            inverse = Polynomial.from_ints(
+                batch_inverse(other.ints, Scalar.field_modulus), Basis.LAGRANGE
+            )
+            return self * inverse
+        return self * (1 / Scalar(other))
+
+    def shift(self, shift: int) -> "LazyPolynomial":
+        return self.evaluate().shift(shift).lazy()
+
+    def evaluate(self) -> Polynomial:
+        # Number every distinct node, children first
+        leaf_ids: list[int] = []
+        consts: list[int] = []
+        lines: list[str] = []
+        names: dict[tuple, str] = {}
+
+        def visit(key):
+            if key in names:
+                return names[key]
+            if key[0] == "leaf":
+                names[key] = "x{}".format(len(leaf_ids))
+                leaf_ids.append(key[1])
+            elif key[0] == "const":
+                names[key] = "c{}".format(len(consts))
+                consts.append(key[1])
+            else:
+                left, right = visit(key[1]), visit(key[2])
+                names[key] = "t{}".format(len(lines))
+                if key[0] == "*":
+                    lines.append("{} = {} * {} % m".format(names[key], left, right))
+                else:
+                    lines.append(
+                        "{} = {} {} {}".format(names[key], left, key[0], right)
+                    )
+            return names[key]
+
+        result = visit(self.key)
+        assert leaf_ids, "Expression does not depend on any polynomial"
+        columns = [self.leaves[i] for i in leaf_ids]
+        assert all(len(c) == len(columns[0]) for c in columns)
+        kernel = compile_kernel(len(leaf_ids), len(consts), lines, result)
+        return Polynomial.from_ints(
+            kernel(Scalar.field_modulus, *columns, *consts), Basis.LAGRANGE
         )
+
+
+# Generated kernels, keyed by their source. The constants are arguments, so
+# the same expression reuses its kernel across proofs
+KERNELS = {}
+
+
+# Generates a function that runs `lines` at every point: it takes the
+# modulus, then one list of ints per leaf, then the constants, and returns
+# the list of values of `result`
+def compile_kernel(num_leaves: int, num_consts: int, lines: list[str], result: str):
+    xs = ["x{}".format(i) for i in range(num_leaves)]
+    cs = ["c{}".format(i) for i in range(num_consts)]
+    src = "\n".join(
+        [
+            "def kernel(m, {}):".format(
+                ", ".join(["l{}".format(i) for i in range(num_leaves)] + cs)
+            ),
+            "    o = []",
+            "    append = o.append",
+            "    for ({},) in zip({}):".format(
+                ", ".join(xs), ", ".join("l{}".format(i) for i in range(num_leaves))
+            ),
+        ]
+        + ["        " + line for line in lines]
+        + ["        append({} % m)".format(result), "    return o"]
+    )
+    if src not in KERNELS:
+        namespace: dict[str, Any] = {}
+        exec(src, namespace)
+        KERNELS[src] = namespace["kernel"]
+    return KERNELS[src]
+
+
+# Reorders vals in place so that vals[i] moves to vals[bit_reverse(i)]
+def bit_reverse_permute(vals: list[int]):
+    n = len(vals)
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j ^= bit
+        if i < j:
+            vals[i], vals[j] = vals[j], vals[i]
+
+
+# Forward NTT of a list of ints, in place: iterative radix-2 Cooley-Tukey
+# (decimation in time) on the bit-reversed input. Turns coefficients into
+# evaluations at the roots of unity of order len(vals)
+def ntt(vals: list[int]) -> list[int]:
+    modulus = Scalar.field_modulus
+    n = len(vals)
+    assert n & (n - 1) == 0
+    roots = EvaluationDomain.get(n).twiddles[0]
+    bit_reverse_permute(vals)
+    half = 1
+    while half < n:
+        w = roots[:: n // (2 * half)]
+        for start in range(0, n, 2 * half):
+            for k in range(half):
+                i = start + k
+                j = i + half
+                x = vals[i]
+                y = vals[j] * w[k] % modulus
+                vals[i] = (x + y) % modulus
+                vals[j] = (x - y) % modulus
+        half *= 2
+    return vals
+
+
+# Inverse NTT of a list of ints, in place: iterative radix-2 Gentleman-Sande
+# (decimation in frequency) with the inverse twiddles, followed by the
+# bit-reversal and the division by len(vals)
+def intt(vals: list[int]) -> list[int]:
+    modulus = Scalar.field_modulus
+    n = len(vals)
+    assert n & (n - 1) == 0
+    domain = EvaluationDomain.get(n)
+    roots = domain.twiddles[1]
+    half = n // 2
+    while half >= 1:
+        w = roots[:: n // (2 * half)]
+        for start in range(0, n, 2 * half):
+            for k in range(half):
+                i = start + k
+                j = i + half
+                x = vals[i]
+                y = vals[j]
+                vals[i] = (x + y) % modulus
+                vals[j] = (x - y) * w[k] % modulus
+        half //= 2
+    bit_reverse_permute(vals)
+    n_inv = domain.n_inv.n
+    for i in range(n):
+        vals[i] = vals[i] * n_inv % modulus
+    return vals
@@ -1,10 +1,16 @@
 from compiler.program import Program, CommonPreprocessedInput
+from compiler.assembly import GateWires
 from utils import *
 from setup import *
-from typing import Optional
-from dataclasses import dataclass
+from typing import Optional, Iterable, Iterator
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from collections import deque
+import copy
+import os
+from dataclasses import dataclass, field
 from transcript import Transcript, Message1, Message2, Message3, Message4, Message5
 from poly import Polynomial, Basis
+from domain import EvaluationDomain, COSET_OFFSET
 
 
 @dataclass
@@ -35,22 +41,169 @@ class Proof:
         return proof
 
 
+@dataclass
+class ProofWorkspace:
+    """Per-proof polynomial forms"""
+
+    # Every polynomial of a proof is converted to coefficient form and to the
+    # coset extended Lagrange basis at most once, and later rounds reuse what
+    # earlier rounds computed. Entries are keyed by polynomial name
+
+    # Coefficient (monomial basis) forms
+    coeffs: dict[str, Polynomial] = field(default_factory=dict)
+    # Coset extended Lagrange forms
+    expanded: dict[str, Polynomial] = field(default_factory=dict)
+
+    # Returns the coefficient form of a polynomial, computing it on first use
+    def to_coeffs(self, name: str, poly: Polynomial) -> Polynomial:
+        if name not in self.coeffs:
+            self.coeffs[name] = poly if poly.basis == Basis.MONOMIAL else poly.ifft()
+        return self.coeffs[name]
+
+    # Returns the coset extended Lagrange forms of the given polynomials,
+    # expanding the ones not seen before in a single batch
+    def expand(self, **polys: Polynomial) -> list[Polynomial]:
+        missing = [name for name in polys if name not in self.expanded]
+        if len(missing) > 0:
+            extended = Polynomial.coeffs_to_coset_extended_lagrange_batch(
+                [self.to_coeffs(name, polys[name]) for name in missing], COSET_OFFSET
+            )
+            self.expanded.update(zip(missing, extended))
+        return [self.expanded[name] for name in polys]
+
+
+# The prover of a worker process of `Prover.process_pool`, received once when
+# the worker starts
+WORKER_PROVER: Optional["Prover"] = None
+
+
+def init_prover_worker(prover: "Prover"):
+    global WORKER_PROVER
+    # Proofs are already spread across processes: commit serially in each
+    prover.executor = SerialExecutor()
+    WORKER_PROVER = prover
+
+
+def prove_in_worker(witness: dict[Optional[str], int]) -> Proof:
+    assert WORKER_PROVER is not None
+    return WORKER_PROVER.prove(witness)
+
+
 @dataclass
 class Prover:
     group_order: int
     setup: Setup
     program: Program
     pk: CommonPreprocessedInput
-
-    def __init__(self, setup: Setup, program: Program):
+    wires: list[GateWires]
+    domain: EvaluationDomain
+    # Executor for independent commitments (see Setup.commit_many). If None,
+    # the setup's executor is used
+    executor: Optional[Executor]
+    # The pool started by `process_pool`, whose workers already hold the
+    # prover
+    _pool: Optional[ProcessPoolExecutor]
+    _pool_workers: int
+
+    # pk can be given when it is already known (eg. from an ArtifactStore),
+    # to skip preprocessing the program
+    def __init__(
+        self,
+        setup: Setup,
+        program: Program,
+        executor: Optional[Executor] = None,
+        pk: Optional[CommonPreprocessedInput] = None,
+    ):
+        setup.check_group_order(program.group_order)
         self.group_order = program.group_order
+        self.domain = EvaluationDomain.get(program.group_order)
         self.setup = setup
         self.program = program
-        self.pk = program.common_preprocessed_input()
+        self.pk = program.common_preprocessed_input() if pk is None else pk
+        assert self.pk.group_order == program.group_order
+        self.wires = program.wires()
+        self.executor = executor
+        self._pool = None
+        self._pool_workers = 1
+
+    # Executors can't be pickled, and are not part of the prover
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["executor"] = None
+        state["_pool"] = None
+        return state
 
     def prove(self, witness: dict[Optional[str], int]) -> Proof:
+        return self.new_context().run(witness)
+
+    # The state of a proof (A, B, C, Z, the challenges, the workspace...) is
+    # kept on a context: a shallow copy of this prover, which shares the
+    # setup, the program and pk (with its cached polynomial forms). So one
+    # Prover can run any number of proofs, one after the other or at once
+    def new_context(self) -> "Prover":
+        return copy.copy(self)
+
+    # Proves each witness of `witnesses` (which can be a stream), on
+    # `executor`. Yields the proofs in the order of the witnesses, each as
+    # soon as it is done. If no executor is given, the proofs run on a
+    # process pool of their own with one worker per core, which is shut down
+    # at the end (a pool started by `process_pool` is left as it is)
+    def prove_batch(
+        self,
+        witnesses: Iterable[dict[Optional[str], int]],
+        executor: Optional[Executor] = None,
+    ) -> Iterator[Proof]:
+        own_pool = None
+        if executor is None and (os.cpu_count() or 1) >= 2:
+            own_pool = self.start_pool(os.cpu_count() or 1)
+            executor = own_pool
+        elif executor is None:
+            executor = SerialExecutor()
+        in_worker = executor is self._pool or executor is own_pool
+        fn = prove_in_worker if in_worker else self.prove
+        # Keep every worker busy, without reading the whole stream at once
+        if executor is self._pool:
+            workers = self._pool_workers
+        elif isinstance(executor, SerialExecutor):
+            workers = 1
+        else:
+            workers = os.cpu_count() or 1
+        max_pending = 2 * workers
+        pending: deque[Future] = deque()
+        try:
+            for witness in witnesses:
+                pending.append(executor.submit(fn, witness))
+                while len(pending) >= max_pending or (
+                    len(pending) > 0 and pending[0].done()
+                ):
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown(cancel_futures=True)
+
+    # Starts a process pool whose workers receive this prover (setup,
+    # program and pk) once, when they start, and then only receive
+    # witnesses
+    def process_pool(self, max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+        if self._pool is not None:
+            self._pool.shutdown()
+        self._pool_workers = max_workers or os.cpu_count() or 1
+        self._pool = self.start_pool(self._pool_workers)
+        return self._pool
+
+    # A process pool like the one of `process_pool`, owned by the caller
+    def start_pool(self, max_workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers, initializer=init_prover_worker, initargs=(self,)
+        )
+
+    # Runs a proof, keeping its state on self (see `new_context`)
+    def run(self, witness: dict[Optional[str], int]) -> Proof:
         # Initialise Fiat-Shamir transcript
         transcript = Transcript(b"plonk")
+        self.workspace = ProofWorkspace()
 
         # Collect fixed and public information
         # FIXME: Hash pk and PI into transcript
@@ -68,7 +221,12 @@ class Prover:
 
         # Round 2
         msg_2 = self.round_2()
-        self.alpha, self.fft_cofactor = transcript.round_2(msg_2)
+        # The quotient does not depend on the coset it is computed over, so
+        # rounds 3 and 5 use the fixed COSET_OFFSET rather than the
+        # fft_cofactor challenge, and the fixed polynomials are only moved
+        # to the coset once per circuit
+        self.alpha, _fft_cofactor = transcript.round_2(msg_2)
+        self.fft_cofactor = COSET_OFFSET
 
         # Round 3
         msg_3 = self.round_3()
@@ -98,10 +256,11 @@ class Prover:
         # - A_values: witness[program.wires()[i].L]
         # - B_values: witness[program.wires()[i].R]
         # - C_values: witness[program.wires()[i].O]
-        n_wires = len(program.wires())
-        A_values = [witness[program.wires()[i].L] for i in range(n_wires)]
-        B_values = [witness[program.wires()[i].R] for i in range(n_wires)]
-        C_values = [witness[program.wires()[i].O] for i in range(n_wires)]
+        wires = self.wires
+        n_wires = len(wires)
+        A_values = [witness[wires[i].L] for i in range(n_wires)]
+        B_values = [witness[wires[i].R] for i in range(n_wires)]
+        C_values = [witness[wires[i].O] for i in range(n_wires)]
 
         # Construct A, B, C Lagrange interpolation polynomials for
         # A_values, B_values, C_values
@@ -121,9 +280,14 @@ class Prover:
 
         # Compute a_1, b_1, c_1 commitments to A, B, C polynomials
 
-        a_1 = setup.commit(self.A)
-        b_1 = setup.commit(self.B)
-        c_1 = setup.commit(self.C)
+        a_1, b_1, c_1 = setup.commit_many(
+            [
+                self.workspace.to_coeffs("A", self.A),
+                self.workspace.to_coeffs("B", self.B),
+                self.workspace.to_coeffs("C", self.C),
+            ],
+            self.executor,
+        )
 
         # Sanity check that witness fulfils gate constraints
         assert (
@@ -149,23 +313,29 @@ class Prover:
         # Note the convenience function:
         # self.rlc(val1, val2) = val_1 + self.beta * val_2 + gamma
 
-        roots_of_unity = Scalar.roots_of_unity(group_order)
+        roots_of_unity = self.domain.roots
 
-        Z_values = [Scalar(1)]
-        for i in range(1, group_order + 1):
+        numers = []
+        denos = []
+        for i in range(group_order):
             # (a1 + beta * w1 + gamma) * (b1 + beta * w1 + gamma) * (c1 + beta * w1 + gamma )
-            numer = (
-                self.rlc(self.A.values[i - 1], roots_of_unity[i - 1])
-                * self.rlc(self.B.values[i - 1], 2 * roots_of_unity[i - 1])
-                * self.rlc(self.C.values[i - 1], 3 * roots_of_unity[i - 1])
+            numers.append(
+                self.rlc(self.A.values[i], roots_of_unity[i])
+                * self.rlc(self.B.values[i], 2 * roots_of_unity[i])
+                * self.rlc(self.C.values[i], 3 * roots_of_unity[i])
             )
             # (a1 + beta * s1 + gamma) * (b1 + beta * s2 + gamma) * (c1 + beta * s3 + gamma )
-            deno = (
-                self.rlc(self.A.values[i - 1], self.pk.S1.values[i - 1])
-                * self.rlc(self.B.values[i - 1], self.pk.S2.values[i - 1])
-                * self.rlc(self.C.values[i - 1], self.pk.S3.values[i - 1])
+            denos.append(
+                self.rlc(self.A.values[i], self.pk.S1.values[i])
+                * self.rlc(self.B.values[i], self.pk.S2.values[i])
+                * self.rlc(self.C.values[i], self.pk.S3.values[i])
             )
-            Z_values.append(Scalar(Z_values[-1] * numer / deno))
+
+        # Invert all the denominators at once, then take the running product
+        deno_invs = Scalar.batch_inverse(denos)
+        Z_values = [Scalar(1)]
+        for numer, deno_inv in zip(numers, deno_invs):
+            Z_values.append(Z_values[-1] * numer * deno_inv)
 
         # Check that the last term Z_n = 1
         assert Z_values.pop() == 1
@@ -173,21 +343,16 @@ class Prover:
         # Sanity-check that Z was computed correctly
         for i in range(group_order):
             assert (
-                self.rlc(self.A.values[i], roots_of_unity[i])
-                * self.rlc(self.B.values[i], 2 * roots_of_unity[i])
-                * self.rlc(self.C.values[i], 3 * roots_of_unity[i])
-            ) * Z_values[i] - (
-                self.rlc(self.A.values[i], self.pk.S1.values[i])
-                * self.rlc(self.B.values[i], self.pk.S2.values[i])
-                * self.rlc(self.C.values[i], self.pk.S3.values[i])
-            ) * Z_values[
-                (i + 1) % group_order
-            ] == 0
+                numers[i] * Z_values[i] - denos[i] * Z_values[(i + 1) % group_order]
+                == 0
+            )
 
         # Construct Z, Lagrange interpolation polynomial for Z_values
         self.Z_values_poly = Polynomial(Z_values, Basis.LAGRANGE)
         # Compute z_1 commitment to Z polynomial
-        z_1 = setup.commit(self.Z_values_poly)
+        (z_1,) = setup.commit_many(
+            [self.workspace.to_coeffs("Z", self.Z_values_poly)], self.executor
+        )
 
         # Return z_1
         return Message2(z_1)
@@ -209,76 +374,54 @@ class Prover:
 
         # List of roots of unity at 4x fineness, i.e. the powers of µ
         # where µ^(4n) = 1
-        roots_of_unity4 = self.fft_expand(
-            Polynomial(Scalar.roots_of_unity(group_order), basis=Basis.LAGRANGE)
+        roots_of_unity4 = (
+            Polynomial(self.domain.extended.roots, Basis.LAGRANGE) * self.fft_cofactor
         )
-        print("roots of unity 4", roots_of_unity4.ifft().values)
-
-        # Using self.fft_expand, move A, B, C into coset extended Lagrange basis
-        A_coset = self.fft_expand(self.A)
-        B_coset = self.fft_expand(self.B)
-        C_coset = self.fft_expand(self.C)
 
-        # Expand public inputs polynomial PI into coset extended Lagrange
-        PI_coset = self.fft_expand(self.PI)
+        # Using self.workspace, move into the coset extended Lagrange basis,
+        # in one batch:
+        # - A, B, C
+        # - the public inputs polynomial PI
+        # - the permutation grand product polynomial Z
+        # - L0, the Lagrange basis polynomial that evaluates to 1 at
+        #   x = 1 = ω^0 and 0 at other roots of unity
+        L0 = Polynomial([Scalar(1)] + [Scalar(0)] * (group_order - 1), Basis.LAGRANGE)
+        A_coset, B_coset, C_coset, PI_coset, Z_coset, L0_coset = self.workspace.expand(
+            A=self.A, B=self.B, C=self.C, PI=self.PI, Z=self.Z_values_poly, L0=L0
+        )
 
-        # Expand selector polynomials pk.QL, pk.QR, pk.QM, pk.QO, pk.QC
-        # into the coset extended Lagrange basis
-        QL_coset = self.fft_expand(self.pk.QL)
-        QR_coset = self.fft_expand(self.pk.QR)
-        QM_coset = self.fft_expand(self.pk.QM)
-        QO_coset = self.fft_expand(self.pk.QO)
-        QC_coset = self.fft_expand(self.pk.QC)
+        # Shifted Z(ω) in the coset extended Lagrange basis: since ω = µ^4,
+        # Z(ω * offset * µ^i) = Z(offset * µ^(i + 4)), so it is Z_coset
+        # rotated by 4
+        Z_w = Z_coset.shift(4)
+
+        # The selector polynomials pk.QL, pk.QR, pk.QM, pk.QO, pk.QC and
+        # the permutation polynomials pk.S1, pk.S2, pk.S3 in the coset
+        # extended Lagrange basis are cached by pk
+        fixed = self.pk.coset_extended()
+        QL_coset = fixed["QL"]
+        QR_coset = fixed["QR"]
+        QM_coset = fixed["QM"]
+        QO_coset = fixed["QO"]
+        QC_coset = fixed["QC"]
+        S1_coset = fixed["S1"]
+        S2_coset = fixed["S2"]
+        S3_coset = fixed["S3"]
 
         self.QL_coset = QL_coset
         self.QR_coset = QR_coset
         self.QM_coset = QM_coset
         self.QO_coset = QO_coset
         self.QC_coset = QC_coset
-
-        # Expand permutation grand product polynomial Z into coset extended
-        # Lagrange basis
-        Z_coset = self.fft_expand(self.Z_values_poly)
         self.Z_coset = Z_coset
-
-        # Expand shifted Z(ω) into coset extended Lagrange basis
-        # possibly incorrect
-        # TODO: why do we shift?
-        Z_w = self.fft_expand(self.Z_values_poly.shift(1))
-
-        # Expand permutation polynomials pk.S1, pk.S2, pk.S3 into coset
-        # extended Lagrange basis
-        S1_coset = self.fft_expand(self.pk.S1)
-        S2_coset = self.fft_expand(self.pk.S2)
-        S3_coset = self.fft_expand(self.pk.S3)
-
         self.S3_coset = S3_coset
 
-        # Compute Z_H = X^N - 1, also in evaluation form in the coset
-        nth = self.fft_expand(
-            Polynomial(Scalar.roots_of_unity(group_order), basis=Basis.LAGRANGE)
-        )
-        z_h = nth
-        for _ in range(group_order - 1):
-            z_h *= nth
-        z_h -= Scalar(1)
-
-        self.z_h = z_h
-        print("val: ", z_h.ifft().values)
-
-        # Compute L0, the Lagrange basis polynomial that evaluates to 1 at x = 1 = ω^0
-        # and 0 at other roots of unity
-
-        # Expand L0 into the coset extended Lagrange basis
-        L0_big = (
-            self.fft_expand(
-                Polynomial(
-                    [Scalar(1)] + [Scalar(0)] * (group_order - 1), Basis.LAGRANGE
-                )
-            )
-            * Scalar(self.alpha)
-            * Scalar(self.alpha)
-        )
+        # The inverse of Z_H = X^N - 1 in evaluation form in the coset, which
+        # every term of the quotient is divided by
+        _, z_h_inv_values = self.domain.vanishing_on_coset(self.fft_cofactor)
+        z_h_inv = Polynomial(z_h_inv_values, Basis.LAGRANGE)
+
+        L0_big = L0_coset * Scalar(self.alpha) * Scalar(self.alpha)
         self.L0 = L0_big
 
         # Compute the quotient polynomial (called T(x) in the paper)
@@ -297,6 +440,49 @@ class Prover:
         #    (Z - 1) * L0 = 0
         #    L0 = Lagrange polynomial, equal at all roots of unity except 1
 
+        # The quotient is built as one lazy expression (see LazyPolynomial),
+        # evaluated in a single fused pass over the points of the coset
+        (
+            A_coset,
+            B_coset,
+            C_coset,
+            PI_coset,
+            Z_coset,
+            Z_w,
+            QL_coset,
+            QR_coset,
+            QM_coset,
+            QO_coset,
+            QC_coset,
+            S1_coset,
+            S2_coset,
+            S3_coset,
+            roots_of_unity4,
+            z_h_inv,
+            L0_big,
+        ) = (
+            poly.lazy()
+            for poly in (
+                A_coset,
+                B_coset,
+                C_coset,
+                PI_coset,
+                Z_coset,
+                Z_w,
+                QL_coset,
+                QR_coset,
+                QM_coset,
+                QO_coset,
+                QC_coset,
+                S1_coset,
+                S2_coset,
+                S3_coset,
+                roots_of_unity4,
+                z_h_inv,
+                L0_big,
+            )
+        )
+
         correctGates = (
             A_coset * QL_coset
             + B_coset * QR_coset
@@ -304,7 +490,7 @@ class Prover:
             + C_coset * QO_coset
             + PI_coset
             + QC_coset
-        ) / z_h
+        ) * z_h_inv
 
         permutationAccum = Z_coset * Scalar(self.alpha) * (
             self.rlc(A_coset, roots_of_unity4)
@@ -318,29 +504,35 @@ class Prover:
 
         QUOT_big = (
             correctGates
-            + permutationAccum / z_h
-            + ((Z_coset - Scalar(1)) * L0_big / z_h)
-        )
+            + permutationAccum * z_h_inv
+            + ((Z_coset - Scalar(1)) * L0_big * z_h_inv)
+        ).evaluate()
         self.QUOT_big = QUOT_big
 
-        # Sanity check: QUOT has degree < 3n
-        assert (
-            self.expanded_evals_to_coeffs(QUOT_big).values[-group_order:]
-            == [0] * group_order
-        )
-
         QUOTE_expanded = self.expanded_evals_to_coeffs(QUOT_big).values
+
+        # Sanity check: QUOT has degree < 3n
+        assert QUOTE_expanded[-group_order:] == [0] * group_order
         print("Generated the quotient polynomial")
 
         # Split up T into T1, T2 and T3 (needed because T has degree 3n - 4, so is
         # too big for the trusted setup)
-        T1 = Polynomial(QUOTE_expanded[:group_order], Basis.MONOMIAL).fft()
-        T2 = Polynomial(
-            QUOTE_expanded[group_order : group_order * 2], Basis.MONOMIAL
-        ).fft()
-        T3 = Polynomial(
-            QUOTE_expanded[group_order * 2 : group_order * 3], Basis.MONOMIAL
-        ).fft()
+        T1_coeffs = self.workspace.to_coeffs(
+            "T1", Polynomial(QUOTE_expanded[:group_order], Basis.MONOMIAL)
+        )
+        T2_coeffs = self.workspace.to_coeffs(
+            "T2",
+            Polynomial(QUOTE_expanded[group_order : group_order * 2], Basis.MONOMIAL),
+        )
+        T3_coeffs = self.workspace.to_coeffs(
+            "T3",
+            Polynomial(
+                QUOTE_expanded[group_order * 2 : group_order * 3], Basis.MONOMIAL
+            ),
+        )
+        T1 = T1_coeffs.fft()
+        T2 = T2_coeffs.fft()
+        T3 = T3_coeffs.fft()
 
         self.T1 = T1
         self.T2 = T2
@@ -357,9 +549,9 @@ class Prover:
         print("Generated T1, T2, T3 polynomials")
 
         # Compute commitments t_lo_1, t_mid_1, t_hi_1 to T1, T2, T3 polynomials
-        t_lo_1 = setup.commit(T1)
-        t_mid_1 = setup.commit(T2)
-        t_hi_1 = setup.commit(T3)
+        t_lo_1, t_mid_1, t_hi_1 = setup.commit_many(
+            [T1_coeffs, T2_coeffs, T3_coeffs], self.executor
+        )
 
         # Return t_lo_1, t_mid_1, t_hi_1
         return Message3(t_lo_1, t_mid_1, t_hi_1)
@@ -380,7 +572,7 @@ class Prover:
         s1_eval = self.pk.S1.barycentric_eval(self.zeta)
         s2_eval = self.pk.S2.barycentric_eval(self.zeta)
         z_shifted_eval = self.Z_values_poly.barycentric_eval(
-            Scalar.root_of_unity(self.group_order) * self.zeta
+            self.domain.omega * self.zeta
         )
 
         self.a_bar = a_eval
@@ -395,26 +587,32 @@ class Prover:
 
     def round_5(self) -> Message5:
         group_order = self.group_order
+        zeta = self.zeta
         # Evaluate the Lagrange basis polynomial L0 at zeta
         L0 = Polynomial([Scalar(1)] + [Scalar(0)] * (group_order - 1), Basis.LAGRANGE)
         L0_eval = L0.barycentric_eval(self.zeta)
         # Evaluate the vanishing polynomial Z_H(X) = X^n - 1 at zeta
         ZH_eval = self.zeta**group_order - 1
 
-        # Move T1, T2, T3 into the coset extended Lagrange basis
-        # Move pk.QL, pk.QR, pk.QM, pk.QO, pk.QC into the coset extended Lagrange basis
-        # Move Z into the coset extended Lagrange basis
-        # Move pk.S3 into the coset extended Lagrange basis
-        T1_expand = self.fft_expand(self.T1)
-        T2_expand = self.fft_expand(self.T2)
-        T3_expand = self.fft_expand(self.T3)
-        QL_expand = self.fft_expand(self.pk.QL)
-        QR_expand = self.fft_expand(self.pk.QR)
-        QM_expand = self.fft_expand(self.pk.QM)
-        QO_expand = self.fft_expand(self.pk.QO)
-        QC_expand = self.fft_expand(self.pk.QC)
-        Z_expand = self.fft_expand(self.Z_values_poly)
-        S3_expand = self.fft_expand(self.pk.S3)
+        # Move T1 + T2 * zeta^n + T3 * zeta^2n into the coset extended
+        # Lagrange basis. Combining the coefficients first takes one FFT
+        # instead of three
+        coeffs = self.workspace.coeffs
+        (T_expand,) = self.workspace.expand(
+            T=coeffs["T1"]
+            + coeffs["T2"] * zeta**group_order
+            + coeffs["T3"] * zeta ** (2 * group_order)
+        )
+        # Z was moved into the coset extended Lagrange basis in round 3, and
+        # pk.QL, pk.QR, pk.QM, pk.QO, pk.QC, pk.S3 are cached by pk
+        (Z_expand,) = self.workspace.expand(Z=self.Z_values_poly)
+        fixed = self.pk.coset_extended()
+        QL_expand = fixed["QL"]
+        QR_expand = fixed["QR"]
+        QM_expand = fixed["QM"]
+        QO_expand = fixed["QO"]
+        QC_expand = fixed["QC"]
+        S3_expand = fixed["S3"]
 
         # Compute the "linearization polynomial" R. This is a clever way to avoid
         # needing to provide evaluations of _all_ the polynomials that we are
@@ -432,41 +630,50 @@ class Prover:
         PI_eval = self.PI.barycentric_eval(self.zeta)
         k_1 = 2
         k_2 = 3
-        zeta = self.zeta
         a_eval = self.a_bar
         b_eval = self.b_bar
         c_eval = self.c_bar
         s1_eval = self.s1_eval
         s2_eval = self.s2_eval
         z_shifted_eval = self.z_shifted_eval
+        # R and W_z are built as lazy expressions (see LazyPolynomial), each
+        # evaluated in a single fused pass over the points of the coset
+        (QL_lazy, QR_lazy, QM_lazy, QO_lazy, QC_lazy, S3_lazy, Z_lazy, T_lazy) = (
+            poly.lazy()
+            for poly in (
+                QL_expand,
+                QR_expand,
+                QM_expand,
+                QO_expand,
+                QC_expand,
+                S3_expand,
+                Z_expand,
+                T_expand,
+            )
+        )
         R_expand = (
             (
-                QM_expand * a_eval * b_eval
-                + QL_expand * a_eval
-                + QR_expand * b_eval
-                + QO_expand * c_eval
+                QM_lazy * a_eval * b_eval
+                + QL_lazy * a_eval
+                + QR_lazy * b_eval
+                + QO_lazy * c_eval
                 + PI_eval
-                + QC_expand
+                + QC_lazy
             )
             + (
-                Z_expand
+                Z_lazy
                 * self.rlc(a_eval, zeta)
                 * self.rlc(b_eval, k_1 * zeta)
                 * self.rlc(c_eval, k_2 * zeta)
-                - (S3_expand * self.beta + c_eval + self.gamma)
+                - (S3_lazy * self.beta + c_eval + self.gamma)
                 * self.rlc(a_eval, s1_eval)
                 * self.rlc(b_eval, s2_eval)
                 * z_shifted_eval
             )
             * self.alpha
-            + (Z_expand - Scalar(1)) * L0_eval * self.alpha**2
-            - (
-                T1_expand
-                + T2_expand * zeta**group_order
-                + T3_expand * zeta ** (2 * group_order)
-            )
-            * ZH_eval
-        )
+            + (Z_lazy - Scalar(1)) * L0_eval * self.alpha**2
+            - T_lazy * ZH_eval
+        ).evaluate()
 
         R_coeffs = self.expanded_evals_to_coeffs(R_expand).values
         assert R_coeffs[group_order:] == [0] * (group_order * 3)
@@ -474,7 +681,9 @@ class Prover:
         # R = R_expand
 
         # Commit to R
-        R_commitment = self.setup.commit(R)
+        (R_commitment,) = self.setup.commit_many(
+            [Polynomial(R_coeffs[:group_order], Basis.MONOMIAL)], self.executor
+        )
         print("Committed to linearization polynomial R")
         print("R_commitment: ", R_commitment)
 
@@ -486,13 +695,13 @@ class Prover:
         # Generate proof that W(z) = 0 and that the provided evaluations of
         # A, B, C, S1, S2 are correct
 
-        # Move A, B, C into the coset extended Lagrange basis
-        # Move pk.S1, pk.S2 into the coset extended Lagrange basis
-        A_expand = self.fft_expand(self.A)
-        B_expand = self.fft_expand(self.B)
-        C_expand = self.fft_expand(self.C)
-        S1_expand = self.fft_expand(self.pk.S1)
-        S2_expand = self.fft_expand(self.pk.S2)
+        # A, B, C were moved into the coset extended Lagrange basis in round 3,
+        # and pk.S1, pk.S2 are cached by pk
+        A_expand, B_expand, C_expand = (
+            poly.lazy() for poly in self.workspace.expand(A=self.A, B=self.B, C=self.C)
+        )
+        S1_expand = fixed["S1"].lazy()
+        S2_expand = fixed["S2"].lazy()
 
         # In the COSET EXTENDED LAGRANGE BASIS,
         # Construct W_Z = (
@@ -504,46 +713,45 @@ class Prover:
         #   + v**5 * (S2 - s2_eval)
         # ) / (X - zeta)
         v = self.v
-        quarter_roots = Polynomial(
-            Scalar.roots_of_unity(group_order * 4), Basis.LAGRANGE
-        )
+        quarter_roots = Polynomial(self.domain.extended.roots, Basis.LAGRANGE)
 
         W_z_expand = (
-            R_expand
+            R_expand.lazy()
             + (A_expand - a_eval) * v
             + (B_expand - b_eval) * v**2
             + (C_expand - c_eval) * v**3
             + (S1_expand - s1_eval) * v**4
             + (S2_expand - s2_eval) * v**5
         ) / (quarter_roots * self.fft_cofactor - zeta)
+        W_z_expand = W_z_expand.evaluate()
         W_z_coeffs = self.expanded_evals_to_coeffs(W_z_expand).values
 
         # Check that degree of W_z is not greater than n
         assert W_z_coeffs[group_order:] == [0] * (group_order * 3)
 
-        # Compute W_z_1 commitment to W_z
-        W_z = Polynomial(W_z_coeffs[:group_order], Basis.MONOMIAL).fft()
-        W_z_1 = self.setup.commit(W_z)
+        W_z = Polynomial(W_z_coeffs[:group_order], Basis.MONOMIAL)
 
         # Generate proof that the provided evaluation of Z(z*w) is correct. This
         # awkwardly different term is needed because the permutation accumulator
         # polynomial Z is the one place where we have to check between adjacent
         # coordinates, and not just within one coordinate.
         # In other words: Compute W_zw = (Z - z_shifted_eval) / (X - zeta * ω)
-        omega = Scalar.root_of_unity(group_order)
+        omega = self.domain.omega
 
-        W_zw_expand = (Z_expand - z_shifted_eval) / (
+        W_zw_expand = (Z_lazy - z_shifted_eval) / (
             quarter_roots * self.fft_cofactor - zeta * omega
         )
+        W_zw_expand = W_zw_expand.evaluate()
         W_zw_coeffs = self.expanded_evals_to_coeffs(W_zw_expand).values
         print("W_zw_coeffs", W_zw_coeffs)
 
         # Check that degree of W_z is not greater than n
         assert W_zw_coeffs[group_order:] == [0] * (group_order * 3)
 
-        # Compute W_z_1 commitment to W_z
-        W_zw = Polynomial(W_zw_coeffs[:group_order], Basis.MONOMIAL).fft()
-        W_zw_1 = self.setup.commit(W_zw)
+        W_zw = Polynomial(W_zw_coeffs[:group_order], Basis.MONOMIAL)
+
+        # Compute W_z_1 and W_zw_1 commitments to W_z and W_zw
+        W_z_1, W_zw_1 = self.setup.commit_many([W_z, W_zw], self.executor)
 
         print("Generated final quotient witness polynomials")
 
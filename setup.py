@@ -1,15 +1,72 @@
 from utils import *
 import py_ecc.bn128 as b
-from curve import ec_lincomb, G1Point, G2Point
+from curve import ec_lincomb, G1Point, G2Point, FixedBaseTable, SCALAR_BITS
 from compiler.program import CommonPreprocessedInput
 from verifier import VerificationKey
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional, cast
 from poly import Polynomial, Basis
+from domain import EvaluationDomain
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import hashlib
+import mmap
+import os
+import struct
 
 # Recover the trusted setup from a file in the format used in
 # https://github.com/iden3/snarkjs#7-prepare-phase-2
-SETUP_FILE_G1_STARTPOS = 80
-SETUP_FILE_POWERS_POS = 60
+#
+# A .ptau file starts with the magic string "ptau", a u32 version and a u32
+# number of sections. Each section is a u32 type and a u64 size, followed by
+# its contents. All integers are little endian. The sections used here are:
+# - 1 (header): u32 n8 (bytes per field element), the field modulus q on n8
+#   bytes, u32 power (the file holds 2^power powers of tau)
+# - 2 (tauG1): the G1 points [tau^i]₁, as (x, y)
+# - 3 (tauG2): the G2 points [tau^i]₂, as ((x0, x1), (y0, y1))
+# Coordinates are in Montgomery form: x is stored as x * 2^(8 * n8) mod q
+PTAU_MAGIC = b"ptau"
+PTAU_HEADER_SECTION = 1
+PTAU_TAU_G1_SECTION = 2
+PTAU_TAU_G2_SECTION = 3
+
+# Binary cache of a Setup (see `Setup.save`), little endian:
+# - the magic string "PLONKSRS", then u32 version, u32 number of powers,
+#   u32 table window (0 if there is no table), u32 number of table rows,
+#   u32 multiples per table row
+# - the SHA-256 of everything that follows
+# - the powers of x, as (x, y), then X2, as (x0, x1, y0, y1), then the rows
+#   of the table, as (x, y) for each multiple
+# Coordinates are 32-byte integers, already out of Montgomery form
+SRS_CACHE_MAGIC = b"PLONKSRS"
+SRS_CACHE_VERSION = 1
+SRS_CACHE_HEADER = struct.Struct("<8s5I32s")
+
+
+# Runs every task in the calling process, as soon as it is submitted. Use it
+# as the executor of a Setup or Prover to force the serial path
+class SerialExecutor(Executor):
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+# The setup of a worker process of `Setup.process_pool`, received once when
+# the worker starts
+WORKER_SETUP: Optional["Setup"] = None
+
+
+def init_worker(powers_of_x, X2, table):
+    global WORKER_SETUP
+    WORKER_SETUP = Setup(powers_of_x, X2, table)
+
+
+def commit_chunk_in_worker(ints: list[int], start: int) -> Optional[G1Point]:
+    assert WORKER_SETUP is not None
+    return WORKER_SETUP.commit_chunk(ints, start)
 
 
 @dataclass
@@ -19,103 +76,396 @@ class Setup(object):
     powers_of_x: list[G1Point]
     # [x]₂ = xH, where H is a generator of G_2
     X2: G2Point
+    # Optional precomputed multiples of powers_of_x (see `precompute`). When
+    # present, commitments only do additions
+    table: Optional[FixedBaseTable] = None
+    # Executor that independent commitments are fanned out to (see
+    # `commit_many`). If None, commitments run serially. No process pool is
+    # ever started unless asked for (see `process_pool`)
+    executor: Optional[Executor] = field(default=None, repr=False, compare=False)
+    # The pool started by `process_pool`, whose workers already hold the SRS
+    _pool: Optional[ProcessPoolExecutor] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _pool_workers: int = field(default=1, init=False, repr=False, compare=False)
 
+    # Executors can't be pickled, and are not part of the setup
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["executor"] = None
+        state["_pool"] = None
+        return state
+
+    # Loads the first `max_powers` powers of tau in G1 (all of them if None),
+    # and [x]₂. The file is memory-mapped, and only the bytes of the points
+    # that are loaded are read, so the cost grows with `max_powers` rather
+    # than with the size of the file
     @classmethod
-    def from_file(cls, filename):
-        contents = open(filename, "rb").read()
-        powers = 2 ** contents[SETUP_FILE_POWERS_POS]
-
-        # values = integer values of g1 points
-        values = [
-            # bytes -> integer in little endian
-            int.from_bytes(contents[i : i + 32], "little")
-            # range(start, stop, step)
-            # start = 80, stop = 80 + 32 * powers * 2, step = 32
-            for i in range(
-                SETUP_FILE_G1_STARTPOS, SETUP_FILE_G1_STARTPOS + 32 * powers * 2, 32
-            )
-        ]
-
-        assert max(values) < b.field_modulus
-        # The points are encoded in a weird encoding, where all x and y points
-        # are multiplied by a factor (for montgomery optimization?). We can
-        # extract the factor because we know the first point is the generator.
-        factor = b.FQ(values[0]) / b.G1[0]
-        values = [b.FQ(x) / factor for x in values]
-
-        # range(powers) = [0, 1, 2, ..., powers - 1]
-        # powers_of_x = [(values[0], values[1]), (values[2], values[3]), ...]
-        # powers_of_x = [(G, x1G), (x2G, x3G), ...]
-        powers_of_x = [(values[i * 2], values[i * 2 + 1]) for i in range(powers)]
-        print("Extracted G1 side, X^1 point: {}".format(powers_of_x[1]))
-
-        pos = SETUP_FILE_G1_STARTPOS + 32 * powers * 2
-
-        # target = factor * 10857046999023057135944570762232829481370756359578518086990519993285655852781
-        target = (factor * b.G2[0].coeffs[0]).n
-
-        # checks where the target (G2 point) starts & assigns it to pos
-        while pos < len(contents):
-            v = int.from_bytes(contents[pos : pos + 32], "little")
-            if v == target:
-                break
-            pos += 1
-        print("Detected start of G2 side at byte {}".format(pos))
-        # x2_encoding = contents[ pos + 128 : pos + 256 ]; len(x2_encoding) = 128
-        X2_encoding = contents[pos + 32 * 4 : pos + 32 * 8]
-        # X2_values = integer values of g2 points
-        X2_values = [
-            b.FQ(int.from_bytes(X2_encoding[i : i + 32], "little")) / factor
-            for i in range(0, 128, 32)
-        ]
-        # x2 = first element of X2_values
-        X2 = (b.FQ2(X2_values[:2]), b.FQ2(X2_values[2:]))
-        assert b.is_on_curve(X2, b.b2)
-        print("Extracted G2 side, X^1 point: {}".format(X2))
+    def from_file(cls, filename, max_powers: Optional[int] = None):
+        with open(filename, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as contents:
+            if contents[:4] != PTAU_MAGIC:
+                raise Exception("Not a ptau file: {}".format(filename))
+            (num_sections,) = struct.unpack_from("<I", contents, 8)
+            # Section type -> (start of the contents, size)
+            sections = {}
+            pos = 12
+            for _ in range(num_sections):
+                section_type, size = struct.unpack_from("<IQ", contents, pos)
+                sections[section_type] = (pos + 12, size)
+                pos += 12 + size
+
+            header, _ = sections[PTAU_HEADER_SECTION]
+            (n8,) = struct.unpack_from("<I", contents, header)
+            q = int.from_bytes(contents[header + 4 : header + 4 + n8], "little")
+            (power,) = struct.unpack_from("<I", contents, header + 4 + n8)
+            if q != b.field_modulus:
+                raise Exception("ptau file is not over the BN254 base field")
+            powers = 2**power
+            if max_powers is not None:
+                if max_powers < 1:
+                    raise Exception(
+                        "At least one power is needed, {} asked for".format(max_powers)
+                    )
+                if max_powers > powers:
+                    raise Exception(
+                        "ptau file has {} powers, {} needed".format(powers, max_powers)
+                    )
+                powers = max_powers
+
+            # Multiplying by r_inv takes coordinates out of Montgomery form
+            r_inv = pow(2 ** (8 * n8), -1, q)
+
+            def read(pos: int) -> int:
+                return int.from_bytes(contents[pos : pos + n8], "little") * r_inv % q
+
+            # powers_of_x = [(G, x1G), (x2G, x3G), ...]
+            g1, _ = sections[PTAU_TAU_G1_SECTION]
+            powers_of_x = [
+                G1Point((b.FQ(read(pos)), b.FQ(read(pos + n8))))
+                for pos in range(g1, g1 + 2 * n8 * powers, 2 * n8)
+            ]
+            assert powers_of_x[0] == b.G1
+            if len(powers_of_x) > 1:
+                print("Extracted G1 side, X^1 point: {}".format(powers_of_x[1]))
+
+            # X2 is the second point of the G2 section (the first one is H)
+            g2, _ = sections[PTAU_TAU_G2_SECTION]
+            print("Detected start of G2 side at byte {}".format(g2))
+            X2_values = [read(g2 + 4 * n8 + i * n8) for i in range(4)]
+            X2 = G2Point((b.FQ2(X2_values[:2]), b.FQ2(X2_values[2:])))
+            assert b.is_on_curve(X2, b.b2)
+            print("Extracted G2 side, X^1 point: {}".format(X2))
 
-        # powers_of_x = [(G, x1G), (x2G, x3G), ...]
-        # x2 = first element of X2_values (H)
         return cls(powers_of_x, X2)
 
+    # Saves the setup, including the precomputed table if there is one, to a
+    # binary cache that `load` reads back
+    def save(self, filename):
+        def encode(values) -> bytes:
+            return b"".join(int(x).to_bytes(32, "little") for x in values)
+
+        parts = [encode(v for x, y in self.powers_of_x for v in (x.n, y.n))]
+        x, y = self.X2
+        parts.append(encode(list(x.coeffs) + list(y.coeffs)))
+        window, rows, row_length = 0, 0, 0
+        if self.table is not None:
+            window = self.table.window
+            rows = len(self.table.multiples)
+            row_length = len(self.table.multiples[0])
+            for row in self.table.multiples:
+                assert len(row) == row_length
+                parts.append(encode(v for pt in row for v in pt))
+        payload = b"".join(parts)
+        header = SRS_CACHE_HEADER.pack(
+            SRS_CACHE_MAGIC,
+            SRS_CACHE_VERSION,
+            len(self.powers_of_x),
+            window,
+            rows,
+            row_length,
+            hashlib.sha256(payload).digest(),
+        )
+        with open(filename, "wb") as f:
+            f.write(header)
+            f.write(payload)
+
+    # Loads a setup saved by `save`. The file is memory-mapped and checked
+    # (version, sizes and checksum) before anything is decoded
+    @classmethod
+    def load(cls, filename) -> "Setup":
+        with open(filename, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as contents:
+            if len(contents) < SRS_CACHE_HEADER.size:
+                raise Exception("Not a setup cache: {}".format(filename))
+            (
+                magic,
+                version,
+                powers,
+                window,
+                rows,
+                row_length,
+                checksum,
+            ) = SRS_CACHE_HEADER.unpack_from(contents, 0)
+            if magic != SRS_CACHE_MAGIC:
+                raise Exception("Not a setup cache: {}".format(filename))
+            if version != SRS_CACHE_VERSION:
+                raise Exception("Unsupported setup cache version {}".format(version))
+            # A table has one row per power, and one multiple per window
+            if window > 0:
+                consistent = rows == powers and row_length == -(-SCALAR_BITS // window)
+            else:
+                consistent = rows == row_length == 0
+            if not consistent:
+                raise Exception("Inconsistent setup cache: {}".format(filename))
+            start = SRS_CACHE_HEADER.size
+            if len(contents) != start + 64 * powers + 128 + 64 * rows * row_length:
+                raise Exception("Truncated setup cache: {}".format(filename))
+            payload = memoryview(contents)[start:]
+            try:
+                if hashlib.sha256(payload).digest() != checksum:
+                    raise Exception("Corrupted setup cache: {}".format(filename))
+            finally:
+                payload.release()
+
+            def read(i: int) -> int:
+                pos = start + 32 * i
+                return int.from_bytes(contents[pos : pos + 32], "little")
+
+            powers_of_x = [
+                G1Point((b.FQ(read(2 * i)), b.FQ(read(2 * i + 1))))
+                for i in range(powers)
+            ]
+            offset = 2 * powers
+            X2 = G2Point(
+                (
+                    b.FQ2([read(offset), read(offset + 1)]),
+                    b.FQ2([read(offset + 2), read(offset + 3)]),
+                )
+            )
+            offset += 4
+            table = None
+            if window > 0:
+                table = FixedBaseTable(
+                    window,
+                    [
+                        [
+                            (read(offset + 2 * j), read(offset + 2 * j + 1))
+                            for j in range(i * row_length, (i + 1) * row_length)
+                        ]
+                        for i in range(rows)
+                    ],
+                )
+        assert powers_of_x[0] == b.G1
+        assert b.is_on_curve(X2, b.b2)
+        return cls(powers_of_x, X2, table)
+
     # Encodes the KZG commitment that evaluates to the given values in the group
+    # (polynomials already in coefficient form are committed to as they are)
     def commit(self, values: Polynomial) -> G1Point:
-        assert values.basis == Basis.LAGRANGE
-
-        monomial_basis = values.ifft()
+        if values.basis == Basis.LAGRANGE:
+            monomial_basis = values.ifft()
+        else:
+            monomial_basis = values
 
         # Optional: Check values size does not exceed maximum power setup can handle
-        assert len(monomial_basis.values) <= len(self.powers_of_x)
+        assert len(monomial_basis.ints) <= len(self.powers_of_x)
+
+        # The commitment to the zero polynomial is the point at infinity, which
+        # py_ecc represents as None
+        return cast(G1Point, self.commit_chunk(monomial_basis.ints, 0))
+
+    # Partial commitment: the linear combination of
+    # powers_of_x[start : start + len(coeffs)] with coeffs
+    def commit_chunk(self, coeffs: list[int], start: int) -> Optional[G1Point]:
+        if self.table is not None:
+            return self.table.lincomb(coeffs, start)
 
         # Compute linear combination of setup with values
-        pairs = []  # pairs = [(G, a1), (xG, a2), (x2G, a3), ...]
-        for i in range(len(monomial_basis.values)):
-            pairs.append((self.powers_of_x[i], monomial_basis.values[i]))
-        # computes & returns G * a1 + xG * a2 + x2G * a3 + ...
+        # pairs = [(x^start G, a1), (x^{start+1} G, a2), ...]
+        pairs = list(zip(self.powers_of_x[start : start + len(coeffs)], coeffs))
+        # computes & returns x^start G * a1 + x^{start+1} G * a2 + ...
         return ec_lincomb(pairs)
 
+    # Commits to several polynomials, on `executor` (by default
+    # self.executor). Each polynomial is split into `chunks` slices (by
+    # default, enough for every worker to get one) whose partial commitments
+    # run as separate tasks and are added up at the end. Results are in the
+    # same order as `polys`, and identical to calling `commit` on each.
+    # Process pools must come from `process_pool`: any other one would
+    # receive the whole setup with every task
+    def commit_many(
+        self,
+        polys: list[Polynomial],
+        executor: Optional[Executor] = None,
+        chunks: Optional[int] = None,
+    ) -> list[G1Point]:
+        if executor is None:
+            executor = self.executor
+        if executor is None:
+            return [self.commit(poly) for poly in polys]
+        if isinstance(executor, ProcessPoolExecutor) and executor is not self._pool:
+            raise Exception(
+                "Process pools must be started with Setup.process_pool, whose "
+                "workers receive the SRS once"
+            )
+        if chunks is None:
+            chunks = -(-self.num_workers(executor) // len(polys))
+
+        tasks = []  # (index of the polynomial, start, coefficients)
+        for i, poly in enumerate(polys):
+            coeffs = (poly.ifft() if poly.basis == Basis.LAGRANGE else poly).ints
+            assert len(coeffs) <= len(self.powers_of_x)
+            size = max(-(-len(coeffs) // chunks), 1)
+            for start in range(0, len(coeffs), size):
+                tasks.append((i, start, coeffs[start : start + size]))
+
+        # The workers of our own pool already have the SRS: only send the
+        # coefficients
+        fn = commit_chunk_in_worker if executor is self._pool else self.commit_chunk
+        partials = executor.map(
+            fn, [coeffs for _, _, coeffs in tasks], [start for _, start, _ in tasks]
+        )
+        o: list[Optional[tuple[b.FQ, b.FQ]]] = [b.Z1] * len(polys)
+        for (i, _, _), partial in zip(tasks, partials):
+            o[i] = b.add(o[i], partial)
+        # Like `commit`, the point at infinity is None
+        return cast(list[G1Point], o)
+
+    # How many tasks `executor` runs at once
+    def num_workers(self, executor: Executor) -> int:
+        if executor is self._pool:
+            return self._pool_workers
+        if isinstance(executor, SerialExecutor):
+            return 1
+        return os.cpu_count() or 1
+
+    # Starts a process pool whose workers receive the SRS (and the
+    # precomputed table, if any) once, when they start, and then only
+    # receive coefficients. Call `precompute` before this, not after. The
+    # pool runs until it is shut down, or until `close` is called
+    def process_pool(self, max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+        if self._pool is not None:
+            self._pool.shutdown()
+        self._pool_workers = max_workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(
+            self._pool_workers,
+            initializer=init_worker,
+            initargs=(self.powers_of_x, self.X2, self.table),
+        )
+        return self._pool
+
+    # Shuts down the pool started by `process_pool`, if any. A Setup can
+    # also be used as a context manager, which calls this on exit
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            if self.executor is self._pool:
+                self.executor = None
+            self._pool = None
+
+    def __enter__(self) -> "Setup":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Precomputes fixed-base tables for powers_of_x, trading memory for
+    # commitment latency. The window size is picked to make commitments as
+    # fast as possible while keeping the table within `max_bytes` (if given).
+    # Returns the size of the table in bytes
+    def precompute(self, max_bytes: Optional[int] = None, window=None) -> int:
+        if window is None:
+            window = FixedBaseTable.window_size(len(self.powers_of_x), max_bytes)
+        table = FixedBaseTable.build(self.powers_of_x, window)
+        self.table = table
+        print(
+            "Precomputed {} points with window size {} ({} bytes)".format(
+                table.num_points(), window, table.size_in_bytes()
+            )
+        )
+        return table.size_in_bytes()
+
+    # Size in bytes of the precomputed tables (0 if there are none)
+    def table_size(self) -> int:
+        return 0 if self.table is None else self.table.size_in_bytes()
+
+    # Raises if the setup has too few powers of x for the given group order.
+    # Provers check this up front, rather than failing in the middle of a
+    # proof
+    def check_group_order(self, group_order: int):
+        if group_order > len(self.powers_of_x):
+            raise Exception(
+                "Setup too small for group order {}: it has {} powers of x".format(
+                    group_order, len(self.powers_of_x)
+                )
+            )
+
     # Generate the verification key for this program with the given setup
     def verification_key(self, pk: CommonPreprocessedInput) -> VerificationKey:
+        self.check_group_order(pk.group_order)
+        # Commitments to the selector polynomials (multiplication, left,
+        # right, output, constants) and to the permutation polynomials
+        Qm, Ql, Qr, Qo, Qc, S1, S2, S3 = self.commit_many(
+            [pk.QM, pk.QL, pk.QR, pk.QO, pk.QC, pk.S1, pk.S2, pk.S3]
+        )
         # Create the appropriate VerificationKey object
         return VerificationKey(
             group_order=pk.group_order,
             # commitment to multiplication selector polynomial
-            Qm=self.commit(pk.QM),
+            Qm=Qm,
             # commitment to left selector polynomial
-            Ql=self.commit(pk.QL),
+            Ql=Ql,
             # commitment to right selector polynomial
-            Qr=self.commit(pk.QR),
+            Qr=Qr,
             # commitment to output selector polynomial
-            Qo=self.commit(pk.QO),
+            Qo=Qo,
             # 	commitment to constants selector polynomial
-            Qc=self.commit(pk.QC),
+            Qc=Qc,
             # commitment to the first permutation polynomial
-            S1=self.commit(pk.S1),
+            S1=S1,
             # commitment to the second permutation polynomial
-            S2=self.commit(pk.S2),
+            S2=S2,
             # commitment to the third permutation polynomial
-            S3=self.commit(pk.S3),
+            S3=S3,
             # X2 = xH, where H is a generator of G_2
             X_2=self.X2,
             # nth root of unity, n - group order
-            w=Scalar.root_of_unity(group_order=pk.group_order),
+            w=EvaluationDomain.get(pk.group_order).omega,
         )
+
+
+# Times a single commitment of `n` coefficients split across 1 to
+# `max_workers` worker processes, and checks that every split gives the
+# same commitment. It has only been run on a single core so far: how well
+# commitments scale across cores is not measured yet
+def time_commit_scaling(setup: Setup, n: int, max_workers: int):
+    import random, time
+
+    poly = Polynomial.from_ints(
+        [random.randrange(b.curve_order) for _ in range(n)], Basis.MONOMIAL
+    )
+    expected = setup.commit(poly)
+    for workers in range(1, max_workers + 1):
+        pool = setup.process_pool(workers)
+        # Start the workers before timing
+        setup.commit_many([poly], pool)
+        a = time.time()
+        assert setup.commit_many([poly], pool) == [expected]
+        print(
+            "Commitment of {} coefficients with {} workers: {:.3f}s".format(
+                n, workers, time.time() - a
+            )
+        )
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 2048
+    max_workers = int(sys.argv[2]) if len(sys.argv) >= 3 else os.cpu_count() or 1
+    setup = Setup.from_file("test/powersOfTau28_hez_final_11.ptau")
+    time_commit_scaling(setup, n, max_workers)
@@ -0,0 +1,222 @@
+import py_ecc.bn128 as b
+from compiler.program import Program, CommonPreprocessedInput
+from curve import G1Point
+from poly import Polynomial, Basis
+from setup import Setup
+from verifier import VerificationKey
+from domain import EvaluationDomain
+from typing import Optional, cast
+import hashlib
+import mmap
+import os
+import struct
+
+# Artifact files (one per circuit), little endian:
+# - the magic string "PLONKART", then u32 version and u32 group order
+# - the SHA-256 of everything that follows
+# - the Lagrange forms, then the coefficient forms, of QM, QL, QR, QO, QC,
+#   S1, S2, S3 (group order 32-byte integers each)
+# - their coset extended Lagrange forms (4 * group order integers each)
+# - the commitments Qm, Ql, Qr, Qo, Qc, S1, S2, S3 of the verification key,
+#   as (x, y), with (0, 0) for the point at infinity
+ARTIFACT_MAGIC = b"PLONKART"
+ARTIFACT_VERSION = 2
+ARTIFACT_HEADER = struct.Struct("<8s2I32s")
+ARTIFACT_SUFFIX = ".plonk"
+VK_COMMITMENTS = ("Qm", "Ql", "Qr", "Qo", "Qc", "S1", "S2", "S3")
+
+# Default cap on the total size of a store
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+# On-disk store of the preprocessed data of circuits (the
+# CommonPreprocessedInput and the VerificationKey), keyed by a hash of the
+# constraints, the group order and the setup. With a warm store, `get`
+# skips all the preprocessing. Files are evicted least recently used first
+# once the store grows beyond `max_bytes`
+class ArtifactStore:
+    """Preprocessed circuit store"""
+
+    directory: str
+    max_bytes: int
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    # Hash of everything the preprocessed data depends on: the constraints,
+    # the group order, and the part of the setup that is used
+    @staticmethod
+    def key(program: Program, setup: Setup) -> str:
+        h = hashlib.sha256()
+        h.update(struct.pack("<I", program.group_order))
+        for constraint in program.constraints:
+            coeffs = sorted((repr(k), v) for k, v in constraint.coeffs.items())
+            h.update(repr((constraint.wires.as_list(), coeffs)).encode())
+        for x, y in setup.powers_of_x[: program.group_order]:
+            h.update(x.n.to_bytes(32, "little") + y.n.to_bytes(32, "little"))
+        for coord in setup.X2:
+            for c in coord.coeffs:
+                h.update(int(c).to_bytes(32, "little"))
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ARTIFACT_SUFFIX)
+
+    # Returns the preprocessed data of the program, computing and storing it
+    # if the store does not have it yet
+    def get(
+        self, program: Program, setup: Setup
+    ) -> tuple[CommonPreprocessedInput, VerificationKey]:
+        key = self.key(program, setup)
+        artifacts = self.load(key, setup)
+        if artifacts is None:
+            pk = program.common_preprocessed_input()
+            vk = setup.verification_key(pk)
+            self.save(key, pk, vk)
+            artifacts = (pk, vk)
+        return artifacts
+
+    # Loads the artifacts stored under `key`, or returns None if there are
+    # none (or if they are unreadable, in which case they are removed)
+    def load(
+        self, key: str, setup: Setup
+    ) -> Optional[tuple[CommonPreprocessedInput, VerificationKey]]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as contents:
+                artifacts = self.decode(contents, setup)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print("Discarding unreadable artifacts {}: {}".format(path, e))
+            os.remove(path)
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return artifacts
+
+    def save(self, key: str, pk: CommonPreprocessedInput, vk: VerificationKey):
+        def encode(values) -> bytes:
+            return b"".join(int(x).to_bytes(32, "little") for x in values)
+
+        coeffs = pk.coeffs()
+        extended = pk.coset_extended()
+        parts = [encode(getattr(pk, name).ints) for name in pk.POLYNOMIALS]
+        parts += [encode(coeffs[name].ints) for name in pk.POLYNOMIALS]
+        parts += [encode(extended[name].ints) for name in pk.POLYNOMIALS]
+        for name in VK_COMMITMENTS:
+            point = getattr(vk, name)
+            parts.append(encode([0, 0] if point is None else [c.n for c in point]))
+        payload = b"".join(parts)
+        header = ARTIFACT_HEADER.pack(
+            ARTIFACT_MAGIC,
+            ARTIFACT_VERSION,
+            pk.group_order,
+            hashlib.sha256(payload).digest(),
+        )
+        # Write to a temporary file first, so that readers never see a
+        # partial file
+        path = self.path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp_path, path)
+        size = ARTIFACT_HEADER.size + len(payload)
+        if size > self.max_bytes:
+            print(
+                "Artifacts {} ({} bytes) exceed the store size cap ({} bytes)".format(
+                    path, size, self.max_bytes
+                )
+            )
+        self.evict(keep=key)
+
+    @staticmethod
+    def decode(
+        contents, setup: Setup
+    ) -> tuple[CommonPreprocessedInput, VerificationKey]:
+        magic, version, group_order, checksum = ARTIFACT_HEADER.unpack_from(contents, 0)
+        if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION:
+            raise Exception("Unsupported artifact format")
+        start = ARTIFACT_HEADER.size
+        # Lagrange and coefficient forms of group order size, and extended
+        # forms of 4 * group order
+        poly_ints = 6 * len(CommonPreprocessedInput.POLYNOMIALS) * group_order
+        if len(contents) != start + 32 * poly_ints + 64 * len(VK_COMMITMENTS):
+            raise Exception("Truncated artifacts")
+        payload = memoryview(contents)[start:]
+        try:
+            if hashlib.sha256(payload).digest() != checksum:
+                raise Exception("Checksum mismatch")
+        finally:
+            payload.release()
+
+        def read(i: int, count: int) -> list[int]:
+            pos = start + 32 * i
+            return [
+                int.from_bytes(contents[p : p + 32], "little")
+                for p in range(pos, pos + 32 * count, 32)
+            ]
+
+        names = CommonPreprocessedInput.POLYNOMIALS
+        polys = [read(i * group_order, group_order) for i in range(len(names) * 2)]
+        pk = CommonPreprocessedInput(
+            group_order,
+            **{
+                name: Polynomial.from_ints(values, Basis.LAGRANGE)
+                for name, values in zip(names, polys)
+            },
+        )
+        pk._coeffs = {
+            name: Polynomial.from_ints(values, Basis.MONOMIAL)
+            for name, values in zip(names, polys[len(names) :])
+        }
+        extended_start = len(names) * 2 * group_order
+        pk._coset_extended = {
+            name: Polynomial.from_ints(
+                read(extended_start + i * 4 * group_order, 4 * group_order),
+                Basis.LAGRANGE,
+            )
+            for i, name in enumerate(names)
+        }
+        points = read(
+            extended_start + len(names) * 4 * group_order, 2 * len(VK_COMMITMENTS)
+        )
+        commitments: dict[str, G1Point] = {}
+        for name, x, y in zip(VK_COMMITMENTS, points[::2], points[1::2]):
+            if (x, y) == (0, 0):
+                # The point at infinity, None in py_ecc. Like Setup.commit,
+                # the verification key still types it as a G1Point
+                commitments[name] = cast(G1Point, b.Z1)
+            else:
+                commitments[name] = G1Point((b.FQ(x), b.FQ(y)))
+        vk = VerificationKey(
+            group_order=group_order,
+            X_2=setup.X2,
+            w=EvaluationDomain.get(group_order).omega,
+            **commitments,
+        )
+        return pk, vk
+
+    # Removes the least recently used files until the store fits in
+    # max_bytes, except for the artifacts of `keep` (the ones just saved),
+    # which would otherwise be recomputed on every get
+    def evict(self, keep: Optional[str] = None):
+        keep_name = None if keep is None else os.path.basename(self.path(keep))
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ARTIFACT_SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, name in files:
+            if total <= self.max_bytes:
+                break
+            if name != keep_name:
+                os.remove(os.path.join(self.directory, name))
+                total -= size
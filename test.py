@@ -1,12 +1,19 @@
 import pickle
+import copy
+from concurrent.futures import ProcessPoolExecutor
 from TESTING_verifier_DO_NOT_OPEN import TestingVerificationKey
 from compiler.program import Program
-from curve import G1Point
+from compiler.assembly import GateWires, eq_to_assembly, evaluate, tokenize
+from compiler.utils import Cell, Column
+from curve import G1Point, FixedBaseTable
 from poly import Basis, Polynomial
-from setup import Setup
+from setup import Setup, SerialExecutor
+from store import ArtifactStore
 from prover import Prover
 from verifier import VerificationKey
 import json
+import os
+import tempfile
 from test.mini_poseidon import rc, mds, poseidon_hash
 from utils import *
 
@@ -31,6 +38,21 @@ def setup_test():
         vk.w
         == 19540430494807482326159819597004422086093766032135589407132600596362845576832
     )
+    # Loading only the powers a circuit needs
+    small_setup = Setup.from_file("test/powersOfTau28_hez_final_11.ptau", 8)
+    assert small_setup.powers_of_x == setup.powers_of_x[:8]
+    assert small_setup.X2 == setup.X2
+    assert small_setup.commit(dummy_values) == commitment
+    assert Setup.from_file("test/powersOfTau28_hez_final_11.ptau", 1).powers_of_x == [
+        setup.powers_of_x[0]
+    ]
+    try:
+        Setup.from_file("test/powersOfTau28_hez_final_11.ptau", 0)
+        assert False, "Setup without powers was loaded"
+    except AssertionError:
+        raise
+    except Exception as e:
+        assert "At least one power" in str(e)
     print("Successfully created dummy commitment and verification key")
 
 
@@ -56,6 +78,241 @@ def basic_test():
     return setup
 
 
+def fft_test():
+    print("===fft_test===")
+
+    for n in (2, 8, 16):
+        coeffs = [Scalar(i * i + 7) for i in range(n)]
+        evals = Polynomial(coeffs, Basis.MONOMIAL).fft()
+        assert evals.values == [
+            sum(c * root**i for i, c in enumerate(coeffs))
+            for root in Scalar.roots_of_unity(n)
+        ]
+        assert evals.ifft() == Polynomial(coeffs, Basis.MONOMIAL)
+    print("FFT test success")
+
+
+def lazy_polynomial_test():
+    print("===lazy_polynomial_test===")
+
+    a = Polynomial([Scalar(i * i + 7) for i in range(16)], Basis.LAGRANGE)
+    b = Polynomial([Scalar(3 * i + 1) for i in range(16)], Basis.LAGRANGE)
+    eager = (a * b + a - Scalar(5)) * (a * b) / (b + Scalar(2))
+    lazy = (a.lazy() * b + a - Scalar(5)) * (a * b.lazy()) / (b.lazy() + Scalar(2))
+    assert lazy.evaluate() == eager
+    assert (a.lazy() * b).shift(3).evaluate() == (a * b).shift(3)
+    print("Lazy polynomial test success")
+
+
+def fixed_base_test(setup):
+    print("===fixed_base_test===")
+
+    values = Polynomial(list(map(Scalar, range(64))), Basis.LAGRANGE)
+    table_setup = Setup(setup.powers_of_x, setup.X2)
+    size = table_setup.precompute()
+    assert size == table_setup.table_size() > 0
+    assert table_setup.commit(values) == setup.commit(values)
+    print("Fixed-base table test success")
+
+
+def assembly_test():
+    print("===assembly_test===")
+
+    d = eq_to_assembly("d <== a * c - 45 * a + 987")
+    assert d.wires == GateWires("a", "c", "d")
+    assert d.coeffs == {"a*c": 1, "a": -45, "": 987}
+    assert evaluate(tokenize("a - b * c")) == {"a": 1, "b*c": -1}
+    assert evaluate(tokenize("6000 - 700 - 80 + 9")) == {"": 5229}
+    assert eq_to_assembly("-ab === a * b").coeffs == {"a*b": 1, "$output_coeff": -1}
+    for eq in ("7 === 7", "a <== b * * c", "e <== a + b * c * d", "a <== b ^ c"):
+        try:
+            eq_to_assembly(eq)
+            assert False, "Invalid equation was accepted: {}".format(eq)
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+    program = Program(["e public", "c <== a * b", "e <== c * d"], 8)
+    assert program.variables.names == ["e", "a", "b", "c", "d"]
+    print("Assembly test success")
+
+
+def witness_test():
+    print("===witness_test===")
+
+    program = Program.from_str(output_proof_lang(), 1024)
+    batch = [{"L0": i, "M0": 2 * i + 1} for i in range(4)]
+    assignments = program.fill_variable_assignments_batch(batch)
+    assert assignments == [program.fill_variable_assignments(x) for x in batch]
+    assert assignments[1]["M64"] == poseidon_hash(1, 3)
+    # Given outputs are checked instead of assigned
+    program = Program(["c <== a * b + 5", "d <== c - a"], 8)
+    assert program.fill_variable_assignments({"a": 2, "b": 3, "d": 9})["c"] == 11
+    for starting in ({"a": 2, "b": 3, "d": 8}, {"a": 2}):
+        try:
+            program.fill_variable_assignments(starting)
+            assert False, "Invalid assignments were filled: {}".format(starting)
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+    print("Witness test success")
+
+
+def optimizer_test(setup):
+    print("===optimizer_test===")
+
+    program = Program.from_str(output_proof_lang(), 1024)
+    optimized = program.optimized()
+    print(
+        "Optimized program: {} rows before, {} rows after".format(
+            len(program.constraints), len(optimized.constraints)
+        )
+    )
+    assert len(optimized.constraints) < len(program.constraints) * 2 // 3
+    assert optimized.get_public_assignments() == ["L0", "M0", "M64"]
+    assignments = program.fill_variable_assignments({"L0": 1, "M0": 2})
+    optimized_assignments = optimized.fill_variable_assignments({"L0": 1, "M0": 2})
+    assert all(assignments[k] == v for k, v in optimized_assignments.items())
+
+    program = Program(
+        [
+            "e public",
+            "x <== 3",
+            "y <== x * a + a",
+            "z <== y * 2",
+            "unused <== z * a",
+            "e <== z + b",
+        ],
+        8,
+    )
+    optimized = program.optimized(keep=["y"])
+    assert len(optimized.constraints) == 3
+    assignments = optimized.fill_variable_assignments({"a": 1, "b": 2})
+    assert assignments["e"] == 10 and assignments["y"] == 4
+    vk = setup.verification_key(optimized.common_preprocessed_input())
+    proof = Prover(setup, optimized).prove(assignments)
+    assert vk.verify_proof(optimized.group_order, proof, [10])
+    print("Optimizer test success")
+
+
+def group_order_test(setup):
+    print("===group_order_test===")
+
+    assert Program(["e public", "c <== a * b", "e <== c * d"]).group_order == 4
+    program = Program.from_str(output_proof_lang())
+    assert program.group_order == 1024
+    cost = program.cost_estimate()
+    assert cost.extended_order == 4096 and cost.setup_powers == 1024
+    assert cost.proof_msms == {1024: 10}
+    for lines, group_order in ((["c <== a * b"] * 9, 8), (["c <== a * b"], 6)):
+        try:
+            Program(lines, group_order)
+            assert False, "Invalid group order was accepted"
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+    # Setups that are too small are rejected before any preprocessing
+    small_setup = Setup(setup.powers_of_x[:4], setup.X2)
+    try:
+        Prover(small_setup, program)
+        assert False, "Setup too small was accepted"
+    except AssertionError:
+        raise
+    except Exception as e:
+        assert "Setup too small" in str(e)
+    print("Group order test success")
+
+
+def permutation_test():
+    print("===permutation_test===")
+
+    program = Program.from_str(output_proof_lang(), 1024)
+    S = program.make_s_polynomials()
+    wires = [w.as_list() for w in program.wires()]
+    wires += [[None] * 3] * (program.group_order - len(wires))
+    cells = {
+        Cell(column, row).label(program.group_order).n: Cell(column, row)
+        for column in Column.variants()
+        for row in range(program.group_order)
+    }
+    # S is a permutation of the cells that only links uses of the same
+    # variable
+    targets = [cells[x] for column in Column.variants() for x in S[column].ints]
+    assert sorted(targets) == sorted(cells.values())
+    for i, target in enumerate(targets):
+        column, row = divmod(i, program.group_order)
+        assert wires[row][column] == wires[target.row][target.column.value - 1]
+    print("Permutation test success")
+
+
+def setup_cache_test(setup):
+    print("===setup_cache_test===")
+
+    small_setup = Setup(setup.powers_of_x[:16], setup.X2)
+    small_setup.precompute(window=4)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "setup.bin")
+        small_setup.save(filename)
+        assert Setup.load(filename) == small_setup
+        with open(filename, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+        try:
+            Setup.load(filename)
+            assert False, "Corrupted cache was loaded"
+        except Exception as e:
+            assert "Corrupted" in str(e)
+        # A table that doesn't cover every power is caught, even with a valid
+        # checksum
+        partial = Setup(setup.powers_of_x[:16], setup.X2)
+        partial.table = FixedBaseTable.build(setup.powers_of_x[:8], 4)
+        partial.save(filename)
+        try:
+            Setup.load(filename)
+            assert False, "Inconsistent cache was loaded"
+        except Exception as e:
+            assert "Inconsistent" in str(e)
+    print("Setup cache test success")
+
+
+def artifact_store_test(setup):
+    print("===artifact_store_test===")
+
+    program = Program(["e public", "c <== a * b", "e <== c * d"], 8)
+    other = Program(["e public", "c <== a * b", "e <== c + d"], 8)
+    with tempfile.TemporaryDirectory() as directory:
+        store = ArtifactStore(directory)
+        pk, vk = store.get(program, setup)
+        assert len(os.listdir(directory)) == 1
+        # A warm store gives back the same data without preprocessing
+        pk2, vk2 = store.get(program, setup)
+        assert pk2 == pk and vk2 == vk
+        fresh = program.common_preprocessed_input()
+        assert pk2.coeffs() == fresh.coeffs()
+        assert pk2._coset_extended == fresh.coset_extended()
+        assert store.key(other, setup) != store.key(program, setup)
+        # Only the most recently used circuit fits in a small store
+        size = os.path.getsize(store.path(store.key(program, setup)))
+        small = ArtifactStore(directory, max_bytes=size)
+        small.get(other, setup)
+        assert os.listdir(directory) == [
+            os.path.basename(small.path(small.key(other, setup)))
+        ]
+        # Artifacts larger than the cap are still kept until the next save
+        tiny = ArtifactStore(directory, max_bytes=1)
+        tiny.get(program, setup)
+        assert os.path.exists(tiny.path(tiny.key(program, setup)))
+        assert not os.path.exists(tiny.path(tiny.key(other, setup)))
+        assignments = program.fill_variable_assignments({"a": 2, "b": 3, "d": 4})
+        proof = Prover(setup, program, pk=pk2).prove(assignments)
+        assert vk2.verify_proof(8, proof, [24])
+    print("Artifact store test success")
+
+
 # Equivalent to this zkrepl code:
 #
 # template Example () {
@@ -145,6 +402,95 @@ def prover_test(setup):
     return proof
 
 
+# Counts the FFTs done by one proof (not including the per-program ones)
+def fft_count_test(setup):
+    print("===fft_count_test===")
+
+    import poly
+
+    counts = [0]
+    ntt, intt = poly.ntt, poly.intt
+
+    def counting(f):
+        def g(vals):
+            counts[0] += 1
+            return f(vals)
+
+        return g
+
+    program = Program(["e public", "c <== a * b", "e <== c * d"], 8)
+    prover = Prover(setup, program)
+    prover.pk.coset_extended()
+    poly.ntt, poly.intt = counting(ntt), counting(intt)
+    try:
+        prover.prove({"a": 3, "b": 4, "c": 12, "d": 5, "e": 60})
+    finally:
+        poly.ntt, poly.intt = ntt, intt
+    print("FFTs per proof: {}".format(counts[0]))
+    assert counts[0] <= 21
+    assert counts[0] == sum(program.cost_estimate().proof_ffts.values())
+    print("FFT count test success")
+
+
+def executor_test(setup):
+    print("===executor_test===")
+
+    program = Program(["e public", "c <== a * b", "e <== c * d"], 8)
+    assignments = {"a": 3, "b": 4, "c": 12, "d": 5, "e": 60}
+    pk = program.common_preprocessed_input()
+    serial = Prover(setup, program, SerialExecutor()).prove(dict(assignments))
+    # Without an executor, commitments run serially: no pool is started
+    assert setup.commit_many([pk.QL]) == [setup.commit(pk.QL)]
+    assert setup._pool is None
+    pool = setup.process_pool(2)
+    with setup:
+        parallel = Prover(setup, program, pool).prove(dict(assignments))
+        assert setup.commit_many([pk.QL, pk.S1], pool) == [
+            setup.commit(pk.QL),
+            setup.commit(pk.S1),
+        ]
+        # One commitment split across the workers
+        assert setup.commit_many([pk.S1], pool, chunks=3) == [setup.commit(pk.S1)]
+    assert setup._pool is None
+    assert parallel.flatten() == serial.flatten()
+    # Other process pools would receive the whole setup with every task
+    foreign = ProcessPoolExecutor(2)
+    try:
+        setup.commit_many([pk.QL], foreign)
+        assert False, "Foreign process pool was accepted"
+    except AssertionError:
+        raise
+    except Exception as e:
+        assert "Setup.process_pool" in str(e)
+    finally:
+        foreign.shutdown()
+    print("Executor test success")
+
+
+def prove_batch_test(setup):
+    print("===prove_batch_test===")
+
+    program = Program(["e public", "c <== a * b", "e <== c * d"], 8)
+    witnesses = [{"a": a, "b": 4, "c": a * 4, "d": 5, "e": a * 20} for a in range(1, 5)]
+    prover = Prover(setup, program)
+    expected = [prover.prove(dict(w)).flatten() for w in witnesses]
+    serial = prover.prove_batch((dict(w) for w in witnesses), SerialExecutor())
+    assert [proof.flatten() for proof in serial] == expected
+    pool = prover.process_pool(2)
+    try:
+        parallel = prover.prove_batch([dict(w) for w in witnesses], pool)
+        assert [proof.flatten() for proof in parallel] == expected
+        # Without an executor, the batch does not touch the prover's pool
+        default = prover.prove_batch([dict(w) for w in witnesses[:2]])
+        assert [proof.flatten() for proof in default] == expected[:2]
+        assert prover._pool is pool
+        again = prover.prove_batch([dict(witnesses[0])], pool)
+        assert [proof.flatten() for proof in again] == expected[:1]
+    finally:
+        pool.shutdown()
+    print("Batch proving test success")
+
+
 def verifier_test_unoptimized(setup, proof):
     print("===verifier_test_unoptimized===")
 
@@ -168,6 +514,35 @@ def verifier_test_full(setup, proof):
     print("Verifier test success")
 
 
+def verify_batch_test(setup):
+    print("===verify_batch_test===")
+
+    program = Program(["e public", "c <== a * b", "e <== c * d"], 8)
+    vk = setup.verification_key(program.common_preprocessed_input())
+    prover = Prover(setup, program)
+    proofs = [
+        prover.prove({"a": a, "b": 4, "c": a * 4, "d": 5, "e": a * 20})
+        for a in range(1, 5)
+    ]
+    publics = [[a * 20] for a in range(1, 5)]
+    assert vk.verify_batch(proofs, publics) == [True] * 4
+    publics[2] = [61]
+    assert vk.verify_batch(proofs, publics) == [True, True, False, True]
+    # A proof with a point off the curve is rejected, and does not stop the
+    # others from being checked
+    publics[2] = [60]
+    bad = copy.deepcopy(proofs[1])
+    bad.msg_5.W_z_1 = (bad.msg_5.W_z_1[0], bad.msg_5.W_z_1[0])
+    assert not vk.verify_proof(8, bad, publics[1])
+    assert vk.verify_batch([proofs[0], bad] + proofs[2:], publics) == [
+        True,
+        False,
+        True,
+        True,
+    ]
+    print("Batch verification test success")
+
+
 def factorization_test(setup):
     print("===factorization_test===")
 
@@ -261,9 +636,16 @@ def poseidon_test(setup):
 
 if __name__ == "__main__":
     # Step 1: Pass setup test
+    fft_test()
+    lazy_polynomial_test()
+    assembly_test()
+    witness_test()
+    permutation_test()
     setup_test()
 
     setup = basic_test()
+    fixed_base_test(setup)
+    setup_cache_test(setup)
 
     # Step 2: Pass prover test using verifier we provide (DO NOT READ TEST VERIFIER CODE)
     prover_test_dummy_verifier(setup)
@@ -278,6 +660,13 @@ if __name__ == "__main__":
     ab_plus_a_test(setup)
     one_public_input_test(setup)
     proof = prover_test(setup)
+    fft_count_test(setup)
+    executor_test(setup)
+    prove_batch_test(setup)
     verifier_test_full(setup, proof)
+    verify_batch_test(setup)
+    artifact_store_test(setup)
+    optimizer_test(setup)
+    group_order_test(setup)
     factorization_test(setup)
     poseidon_test(setup)
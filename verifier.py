@@ -1,9 +1,11 @@
 import py_ecc.bn128 as b
 from utils import *
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 from curve import *
 from transcript import Transcript
 from poly import Polynomial, Basis
+import secrets
 
 
 @dataclass
@@ -32,25 +34,27 @@ class VerificationKey:
     X_2: G2Point
     # nth root of unity (i.e. ω^1), where n is the program's group order.
     w: Scalar
+    # Precomputed Miller loop lines for X_2 and for the generator of G2,
+    # which every pairing check of this key uses (see `g2_lines`)
+    _g2_lines: Optional[tuple[G2Lines, G2Lines]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    # The G2Lines of X_2 and of the generator of G2, built on first use
+    def g2_lines(self) -> tuple[G2Lines, G2Lines]:
+        if self._g2_lines is None:
+            self._g2_lines = (G2Lines.build(self.X_2), G2Lines.build(b.G2))
+        return self._g2_lines
 
     # More optimized version that tries hard to minimize pairings and
     # elliptic curve multiplications, but at the cost of being harder
     # to understand and mixing together a lot of the computations to
     # efficiently batch them
     def verify_proof(self, group_order: int, pf, public=[]) -> bool:
-        # 4. Compute challenges
-
-        # 5. Compute zero polynomial evaluation Z_H(ζ) = ζ^n - 1
-
-        # 6. Compute Lagrange polynomial evaluation L_0(ζ)
-
-        # 7. Compute public input polynomial evaluation PI(ζ).
-
-        # Compute the constant term of R. This is not literally the degree-0
-        # term of the R polynomial; rather, it's the portion of R that can
-        # be computed directly, without resorting to elliptic cutve commitments
-
-        # Compute D = (R - r0) + u * Z, and E and F
+        assert group_order == self.group_order
+        if not self.well_formed(pf):
+            return False
+        left, right = self.pairing_terms(pf, public)
 
         # Run one pairing check to verify the last two checks.
         # What's going on here is a clever re-arrangement of terms to check
@@ -68,28 +72,293 @@ class VerificationKey:
         #
         # so at this point we can take a random linear combination of the two
         # checks, and verify it with only one pairing.
+        X2_lines, G2_lines = self.g2_lines()
+        return pairing_product_check(
+            [(ec_lincomb(left), X2_lines), (b.neg(ec_lincomb(right)), G2_lines)]
+        )
+
+    # Verifies many proofs for this key at once. The pairing checks of all
+    # the proofs are combined with random weights into a single one. Each of
+    # its G1 sides is one linear combination over all the proofs, where the
+    # points of the key, shared by every proof, appear only once. It is
+    # checked with two Miller loops and a single final exponentiation. If the
+    # combined check fails, the batch is split in halves to find the invalid
+    # proofs. Malformed proofs (see `well_formed`) are rejected up front,
+    # and left out of the combined check. Returns whether each proof is valid
+    def verify_batch(self, proofs: list, publics: list[list[int]]) -> list[bool]:
+        assert len(proofs) == len(publics)
+        valid = [self.well_formed(pf) for pf in proofs]
+        # Pairing terms of the well-formed proofs, by index
+        terms = {
+            i: self.pairing_terms(pf, public)
+            for i, (pf, public) in enumerate(zip(proofs, publics))
+            if valid[i]
+        }
+        weights = [Scalar(1)] + [
+            Scalar(secrets.randbelow(b.curve_order - 1) + 1)
+            for _ in range(len(proofs) - 1)
+        ]
+
+        def check(indices: list[int]) -> bool:
+            left: dict[tuple[int, int], tuple[G1Point, Scalar]] = {}
+            right: dict[tuple[int, int], tuple[G1Point, Scalar]] = {}
+            for i in indices:
+                for combination, side in zip(terms[i], (left, right)):
+                    for pt, coeff in combination:
+                        if pt is b.Z1:
+                            continue
+                        key = (pt[0].n, pt[1].n)
+                        total = side[key][1] if key in side else Scalar(0)
+                        side[key] = (pt, total + coeff * weights[i])
+            X2_lines, G2_lines = self.g2_lines()
+            return pairing_product_check(
+                [
+                    (ec_lincomb(list(left.values())), X2_lines),
+                    (b.neg(ec_lincomb(list(right.values()))), G2_lines),
+                ]
+            )
 
-        return False
+        def bisect(indices: list[int]):
+            if len(indices) == 0 or check(indices):
+                return
+            if len(indices) == 1:
+                valid[indices[0]] = False
+                return
+            bisect(indices[: len(indices) // 2])
+            bisect(indices[len(indices) // 2 :])
+
+        bisect(list(terms))
+        return valid
+
+    # Whether every point of the proof is a point of G1 (other than the
+    # point at infinity, which the transcript can't encode), and every
+    # evaluation is a Scalar. Other proofs are rejected before any of their
+    # points is used
+    def well_formed(self, pf) -> bool:
+        proof = pf.flatten()
+        for key, value in proof.items():
+            if key.endswith("_eval"):
+                if not isinstance(value, Scalar):
+                    return False
+            elif not is_affine_point(value):
+                return False
+        return True
+
+    # The two sides of the single pairing check of `verify_proof`, as linear
+    # combinations of G1 points: the proof is valid iff
+    # e(left, [x]₂) = e(right, [1]₂)
+    def pairing_terms(
+        self, pf, public: list[int]
+    ) -> tuple[list[tuple[G1Point, Scalar]], list[tuple[G1Point, Scalar]]]:
+        group_order = self.group_order
+        proof = pf.flatten()
+
+        # 4. Compute challenges
+        beta, gamma, alpha, zeta, v, u = self.compute_challenges(pf)
+
+        # 5. Compute zero polynomial evaluation Z_H(ζ) = ζ^n - 1
+        ZH_eval = zeta**group_order - 1
+
+        # 6. Compute Lagrange polynomial evaluation L_0(ζ)
+        L0_eval = ZH_eval / (group_order * (zeta - 1))
+
+        # 7. Compute public input polynomial evaluation PI(ζ).
+        PI_eval = self.public_input_eval(public, zeta)
+
+        a_eval = proof["a_eval"]
+        b_eval = proof["b_eval"]
+        c_eval = proof["c_eval"]
+        s1_eval = proof["s1_eval"]
+        s2_eval = proof["s2_eval"]
+        z_shifted_eval = proof["z_shifted_eval"]
+
+        # Coefficients of [Z]₁ and [S_σ3]₁ in the commitment to R
+        k_1 = 2
+        k_2 = 3
+        z_coeff = (
+            alpha
+            * self.rlc(beta, gamma, a_eval, zeta)
+            * self.rlc(beta, gamma, b_eval, k_1 * zeta)
+            * self.rlc(beta, gamma, c_eval, k_2 * zeta)
+            + alpha**2 * L0_eval
+        )
+        s3_coeff = (
+            -alpha
+            * beta
+            * self.rlc(beta, gamma, a_eval, s1_eval)
+            * self.rlc(beta, gamma, b_eval, s2_eval)
+            * z_shifted_eval
+        )
+
+        # Compute the constant term of R. This is not literally the degree-0
+        # term of the R polynomial; rather, it's the portion of R that can
+        # be computed directly, without resorting to elliptic cutve commitments
+        r0 = (
+            PI_eval
+            - alpha
+            * (c_eval + gamma)
+            * self.rlc(beta, gamma, a_eval, s1_eval)
+            * self.rlc(beta, gamma, b_eval, s2_eval)
+            * z_shifted_eval
+            - alpha**2 * L0_eval
+        )
+
+        # Compute F = [R]₁ + v [A]₁ + v^2 [B]₁ + v^3 [C]₁ + v^4 [S_σ1]₁ +
+        # v^5 [S_σ2]₁ + u [Z]₁, where [R]₁ includes r0, and
+        # E = (v a + v^2 b + v^3 c + v^4 s1 + v^5 s2 + u z_shifted) [1]₁
+        F = [
+            (self.Qm, a_eval * b_eval),
+            (self.Ql, a_eval),
+            (self.Qr, b_eval),
+            (self.Qo, c_eval),
+            (self.Qc, Scalar(1)),
+            (proof["z_1"], z_coeff + u),
+            (self.S3, s3_coeff),
+            (proof["t_lo_1"], -ZH_eval),
+            (proof["t_mid_1"], -ZH_eval * zeta**group_order),
+            (proof["t_hi_1"], -ZH_eval * zeta ** (group_order * 2)),
+            (proof["a_1"], v),
+            (proof["b_1"], v**2),
+            (proof["c_1"], v**3),
+            (self.S1, v**4),
+            (self.S2, v**5),
+        ]
+        E = (
+            v * a_eval
+            + v**2 * b_eval
+            + v**3 * c_eval
+            + v**4 * s1_eval
+            + v**5 * s2_eval
+            + u * z_shifted_eval
+        )
+
+        # e([W_ζ]₁ + u [W_ζω]₁, [x]₂) =
+        #     e(ζ [W_ζ]₁ + u ζ ω [W_ζω]₁ + F - E, [1]₂)
+        left = [(proof["W_z_1"], Scalar(1)), (proof["W_zw_1"], u)]
+        right = [
+            (proof["W_z_1"], zeta),
+            (proof["W_zw_1"], u * zeta * self.w),
+            (b.G1, r0 - E),
+        ] + F
+        return left, right
 
     # Basic, easier-to-understand version of what's going on
     def verify_proof_unoptimized(self, group_order: int, pf, public=[]) -> bool:
+        assert group_order == self.group_order
+        if not self.well_formed(pf):
+            return False
+        proof = pf.flatten()
+
         # 4. Compute challenges
+        beta, gamma, alpha, zeta, v, u = self.compute_challenges(pf)
 
         # 5. Compute zero polynomial evaluation Z_H(ζ) = ζ^n - 1
+        ZH_eval = zeta**group_order - 1
 
         # 6. Compute Lagrange polynomial evaluation L_0(ζ)
+        L0_eval = ZH_eval / (group_order * (zeta - 1))
 
         # 7. Compute public input polynomial evaluation PI(ζ).
+        PI_eval = self.public_input_eval(public, zeta)
+
+        a_eval = proof["a_eval"]
+        b_eval = proof["b_eval"]
+        c_eval = proof["c_eval"]
+        s1_eval = proof["s1_eval"]
+        s2_eval = proof["s2_eval"]
+        z_shifted_eval = proof["z_shifted_eval"]
 
         # Recover the commitment to the linearization polynomial R,
         # exactly the same as what was created by the prover
+        k_1 = 2
+        k_2 = 3
+        R_pt = ec_lincomb(
+            [
+                (self.Qm, a_eval * b_eval),
+                (self.Ql, a_eval),
+                (self.Qr, b_eval),
+                (self.Qo, c_eval),
+                (b.G1, PI_eval),
+                (self.Qc, 1),
+                (
+                    proof["z_1"],
+                    alpha
+                    * self.rlc(beta, gamma, a_eval, zeta)
+                    * self.rlc(beta, gamma, b_eval, k_1 * zeta)
+                    * self.rlc(beta, gamma, c_eval, k_2 * zeta),
+                ),
+                (
+                    self.S3,
+                    -alpha
+                    * beta
+                    * self.rlc(beta, gamma, a_eval, s1_eval)
+                    * self.rlc(beta, gamma, b_eval, s2_eval)
+                    * z_shifted_eval,
+                ),
+                (
+                    b.G1,
+                    -alpha
+                    * (c_eval + gamma)
+                    * self.rlc(beta, gamma, a_eval, s1_eval)
+                    * self.rlc(beta, gamma, b_eval, s2_eval)
+                    * z_shifted_eval,
+                ),
+                (proof["z_1"], alpha**2 * L0_eval),
+                (b.G1, -(alpha**2) * L0_eval),
+                (proof["t_lo_1"], -ZH_eval),
+                (proof["t_mid_1"], -ZH_eval * zeta**group_order),
+                (proof["t_hi_1"], -ZH_eval * zeta ** (group_order * 2)),
+            ]
+        )
 
         # Verify that R(z) = 0 and the prover-provided evaluations
         # A(z), B(z), C(z), S1(z), S2(z) are all correct
+        W_z_rhs = ec_lincomb(
+            [
+                (R_pt, 1),
+                (proof["a_1"], v),
+                (b.G1, -v * a_eval),
+                (proof["b_1"], v**2),
+                (b.G1, -(v**2) * b_eval),
+                (proof["c_1"], v**3),
+                (b.G1, -(v**3) * c_eval),
+                (self.S1, v**4),
+                (b.G1, -(v**4) * s1_eval),
+                (self.S2, v**5),
+                (b.G1, -(v**5) * s2_eval),
+            ]
+        )
+        if not pairing_product_check(
+            [
+                (proof["W_z_1"], b.add(self.X_2, b.neg(ec_mul(b.G2, zeta)))),
+                (b.neg(W_z_rhs), self.g2_lines()[1]),
+            ]
+        ):
+            return False
 
         # Verify that the provided value of Z(zeta*w) is correct
+        W_zw_rhs = ec_lincomb([(proof["z_1"], 1), (b.G1, -z_shifted_eval)])
+        return pairing_product_check(
+            [
+                (
+                    proof["W_zw_1"],
+                    b.add(self.X_2, b.neg(ec_mul(b.G2, zeta * self.w))),
+                ),
+                (b.neg(W_zw_rhs), self.g2_lines()[1]),
+            ]
+        )
+
+    # PI(ζ), where PI is the public input polynomial
+    def public_input_eval(self, public: list[int], zeta: Scalar) -> Scalar:
+        PI = Polynomial(
+            [Scalar(-x) for x in public]
+            + [Scalar(0) for _ in range(self.group_order - len(public))],
+            Basis.LAGRANGE,
+        )
+        return PI.barycentric_eval(zeta)
 
-        return False
+    def rlc(self, beta: Scalar, gamma: Scalar, term_1, term_2) -> Scalar:
+        return term_1 + term_2 * beta + gamma
 
     # Compute challenges (should be same as those computed by prover)
     def compute_challenges(